@@ -0,0 +1,231 @@
+import asyncio
+import logging
+import time
+
+from telegram.error import BadRequest
+from telegram.ext import CommandHandler
+from telegram.helpers import escape_markdown
+
+import outbound
+import state_machine
+
+logger = logging.getLogger(__name__)
+
+DIGEST_INTERVAL = 15  # seconds between digest refreshes
+DIGEST_ITEMS = 10     # deals listed per section; the rest are counted
+
+# Stages waiting on the admin, in the order the digest shows them
+DIGEST_SECTIONS = (
+    (state_machine.PAYMENT_SENT, 'admin_digest_payment_sent'),
+    (state_machine.DISPUTE, 'admin_digest_dispute'),
+    (state_machine.RECEIVED, 'admin_digest_received'),
+)
+
+# command -> (event, stages "all" acts on, group message key, group keyboard,
+# participant whose language the group message is written in).
+# "all" never releases disputes and is not accepted for cancelling.
+BULK_COMMANDS = {
+    'bulk_confirm': ('admin_confirm', (state_machine.PAYMENT_SENT,), 'admin_notified_seller_delivery',
+                     'seller_delivery', 'seller_id'),
+    'bulk_release': ('admin_release', (state_machine.RECEIVED,), 'seller_final_confirm_prompt',
+                     'seller_final', 'seller_id'),
+    'bulk_cancel': ('admin_cancel', None, 'admin_cancelled_deal_group', None, 'buyer_id'),
+}
+
+# Placeholders that land outside `code` spans in the Markdown messages. One "_"
+# in a username would otherwise make Telegram reject the whole message.
+MARKDOWN_FIELDS = ('buyer_username', 'seller_username', 'admin_username')
+
+
+def markdown_values(values):
+    """Returns a copy of values with MARKDOWN_FIELDS escaped for parse_mode='Markdown'."""
+    safe = dict(values)
+    for field in MARKDOWN_FIELDS:
+        if safe.get(field):
+            safe[field] = escape_markdown(str(safe[field]))
+    return safe
+
+
+class AdminQueue:
+    """Admin alerts folded into one digest message, plus bulk admin commands.
+
+    In queue mode, alert() only marks the digest dirty; a background task
+    re-renders it from the stage index at most every `interval` seconds and
+    edits the same message in place. With queue mode off alerts go out as
+    individual DMs, as before. The bulk commands work in either mode.
+
+    With poll on, the digest is re-rendered every interval whether or not it
+    was notified, for when other processes change deals too.
+    """
+
+    def __init__(self, async_store, catalog, scheduler, admin_id, enabled=True,
+                 interval=DIGEST_INTERVAL, items=DIGEST_ITEMS, poll=False):
+        self.store = async_store
+        self.catalog = catalog
+        self.scheduler = scheduler
+        self.admin_id = admin_id
+        self.enabled = enabled
+        self.interval = interval
+        self.items = items
+        self.poll = poll
+        self.message_id = None
+        self._last_body = None
+        self._dirty = True
+        self._task = None
+
+    # --- Alerts ---
+    def alert(self, text, reply_markup=None):
+        """Sends an admin alert, or in queue mode leaves it to the next digest."""
+        if self.enabled:
+            self.notify()
+            return None
+        return self.scheduler.send_message(self.admin_id, text, outbound.PRIORITY_ADMIN,
+                                           reply_markup=reply_markup, parse_mode='Markdown')
+
+    def notify(self):
+        """Marks the digest as out of date."""
+        self._dirty = True
+
+    # --- Digest ---
+    async def render_body(self, language):
+        counts = await self.store.count_deals_by_stage()
+        render = self.catalog.render
+        lines = []
+        for stage, key in DIGEST_SECTIONS:
+            count = counts.get(stage, 0)
+            if not count:
+                continue
+            lines.append('')
+            lines.append(render(language, key, count=count))
+            for deal in await self.store.get_deals_in_stage(stage, self.items):
+                lines.append(render(language, 'admin_digest_item', markdown_values(deal)))
+            if count > self.items:
+                lines.append(render(language, 'admin_digest_more', count=count - self.items))
+        waiting = bool(lines)
+        lines.append('')
+        lines.append(render(language, 'admin_digest_commands' if waiting else 'admin_digest_empty'))
+        return '\n'.join(lines)
+
+    async def refresh(self):
+        """Re-renders the digest and edits it in place if anything changed."""
+        language = await self.store.get_user_language(self.admin_id)
+        body = await self.render_body(language)
+        if body == self._last_body and self.message_id is not None:
+            return
+        text = self.catalog.render(language, 'admin_digest_title', time=time.strftime('%H:%M')) + '\n' + body
+        if self.message_id is not None:
+            try:
+                await self.scheduler.edit_message_text(self.admin_id, self.message_id, text,
+                                                       outbound.PRIORITY_ADMIN, parse_mode='Markdown')
+            except BadRequest as error:
+                if 'not modified' not in str(error).lower():
+                    # Deleted or too old to edit: post a fresh digest instead
+                    self.message_id = None
+        if self.message_id is None:
+            message = await self.scheduler.send_message(self.admin_id, text, outbound.PRIORITY_ADMIN,
+                                                        parse_mode='Markdown')
+            self.message_id = message.message_id
+        self._last_body = body
+
+    async def _run(self):
+        while True:
+            if self._dirty or self.poll:
+                self._dirty = False
+                try:
+                    await self.refresh()
+                except Exception:
+                    logger.exception("Could not refresh the admin digest")
+                    self._dirty = True
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self.enabled and self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    # --- Bulk Commands ---
+    async def bulk_command(self, update, context):
+        """/bulk_confirm, /bulk_release, /bulk_cancel: one transaction for many deals."""
+        user = update.effective_user
+        # effective_message: CommandHandler also fires for edited commands
+        message = update.effective_message
+        language = await self.store.get_user_language(user.id)
+        if user.id != self.admin_id:
+            await message.reply_text(self.catalog.render(language, 'admin_only_command'))
+            return
+        command = message.text.split()[0].lstrip('/').split('@')[0]
+        event, all_stages, group_key, keyboard, reader = BULK_COMMANDS[command]
+
+        chat_ids, sources = None, all_stages
+        if context.args != ['all'] or all_stages is None:
+            try:
+                chat_ids = [int(arg) for arg in context.args]
+            except ValueError:
+                chat_ids = []
+            sources = None
+            if not chat_ids:
+                usage = 'admin_cancel_usage' if all_stages is None else 'admin_bulk_usage'
+                await message.reply_text(self.catalog.render(language, usage, command=command),
+                                         parse_mode='Markdown')
+                return
+
+        deals = await state_machine.fire_many_async(self.store, chat_ids, event, sources)
+        admin_name = user.username or user.first_name
+        for deal in deals:
+            # The group reads the notice, so use the participant's language, not the admin's
+            deal_language = await self.store.get_user_language(deal[reader]) if deal[reader] else language
+            text = self.catalog.render(deal_language, group_key,
+                                       markdown_values(dict(deal, admin_username=admin_name)))
+            markup = self.catalog.keyboard(deal_language, keyboard) if keyboard else None
+            self.scheduler.send_message(deal['chat_id'], text, outbound.PRIORITY_CHAT,
+                                        reply_markup=markup, parse_mode='Markdown')
+        self.notify()
+        skipped = len(chat_ids) - len(deals) if chat_ids is not None else 0
+        self.scheduler.send_message(
+            self.admin_id,
+            self.catalog.render(language, 'admin_bulk_result', done=len(deals), skipped=skipped),
+            outbound.PRIORITY_ADMIN,
+        )
+
+    def handlers(self):
+        return [CommandHandler(list(BULK_COMMANDS), self.bulk_command)]
+
+
+def attach(application, async_store, catalog, admin_id, enabled=True, interval=DIGEST_INTERVAL,
+           poll=False, post_digest=True):
+    """Registers the bulk commands and runs the digest for the application's lifetime.
+
+    Uses the application's OutboundScheduler, attaching one if needed. The
+    queue is kept in application.bot_data['admin_queue']. With several
+    webhook workers only one should post_digest; the others still hold
+    alerts back in queue mode and leave the digest to it.
+    """
+    scheduler = application.bot_data.get('outbound') or outbound.attach(application)
+    queue = AdminQueue(async_store, catalog, scheduler, admin_id, enabled, interval, poll=poll)
+    application.bot_data['admin_queue'] = queue
+    application.add_handlers(queue.handlers())
+    previous_init, previous_stop = application.post_init, application.post_stop
+
+    async def post_init(app):
+        if previous_init is not None:
+            await previous_init(app)
+        if post_digest:
+            queue.start()
+
+    async def post_stop(app):
+        # Before the scheduler's post_stop, so no digest edit is queued after its flush
+        await queue.stop()
+        if previous_stop is not None:
+            await previous_stop(app)
+
+    application.post_init = post_init
+    application.post_stop = post_stop
+    return queue
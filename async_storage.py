@@ -0,0 +1,174 @@
+import asyncio
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import metrics
+from cache import MISSING
+from storage import PAGE_SIZE
+
+# --- Write Batching ---
+BATCH_WINDOW = 0.002  # seconds to wait for more writes before committing
+MAX_BATCH = 200       # writes per transaction at most
+READ_WORKERS = 4
+
+_STOP = object()
+
+
+class AsyncStorage:
+    """Awaitable front for Storage so DB work never blocks the event loop.
+
+    Reads run on a small thread pool (each thread keeps its own pooled
+    connection). Writes go to a single writer thread which groups everything
+    that arrives within BATCH_WINDOW into one transaction.
+    """
+
+    def __init__(self, store, batch_window=BATCH_WINDOW, max_batch=MAX_BATCH, read_workers=READ_WORKERS):
+        self.store = store
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self._readers = ThreadPoolExecutor(max_workers=read_workers, thread_name_prefix='db-read')
+        self._writes = queue.Queue()
+        self._writer = None
+        self._writer_lock = threading.Lock()
+
+    # --- Plumbing ---
+    async def read(self, fn, *args):
+        """Runs a blocking read on the reader pool."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._readers, metrics.timed_db_call, fn.__name__, fn, *args)
+
+    async def write(self, fn, *args):
+        """Queues a blocking write for the writer thread and waits for its commit."""
+        self._ensure_writer()
+        future = Future()
+        self._writes.put((fn, args, future))
+        return await asyncio.wrap_future(future)
+
+    def _ensure_writer(self):
+        if self._writer is None:
+            with self._writer_lock:
+                if self._writer is None:
+                    self._writer = threading.Thread(target=self._run_writer, name='db-writer', daemon=True)
+                    self._writer.start()
+
+    def _run_writer(self):
+        while True:
+            item = self._writes.get()
+            if item is _STOP:
+                return
+            batch = [item]
+            stopping = False
+            deadline = time.monotonic() + self.batch_window
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self._writes.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            self._commit_batch(batch)
+            if stopping:
+                return
+
+    def _commit_batch(self, batch):
+        results = []
+        metrics.DB_BATCH_SIZE.observe(len(batch))
+        started = time.perf_counter()
+        try:
+            with self.store.transaction():
+                for fn, args, _ in batch:
+                    results.append(metrics.timed_db_call(fn.__name__, fn, *args))
+        except Exception:
+            # One bad write must not fail its neighbours: retry each on its own.
+            for fn, args, future in batch:
+                try:
+                    with self.store.transaction():
+                        result = fn(*args)
+                except Exception as exc:
+                    future.set_exception(exc)
+                else:
+                    future.set_result(result)
+            return
+        metrics.DB_SECONDS.observe(time.perf_counter() - started, 'write_batch')
+        for (_, _, future), result in zip(batch, results):
+            future.set_result(result)
+
+    def close(self):
+        """Flushes pending writes and stops the worker threads."""
+        if self._writer is not None:
+            self._writes.put(_STOP)
+            self._writer.join()
+            self._writer = None
+        self._readers.shutdown(wait=True)
+
+    # --- Deals ---
+    async def save_deal(self, deal_data):
+        await self.write(self.store.save_deal, deal_data)
+
+    async def get_deal(self, chat_id):
+        # Cache hits are answered inline; only misses pay the thread hop
+        deal = self.store.cached_deal(chat_id)
+        if deal is MISSING:
+            return await self.read(self.store.load_deal, chat_id)
+        return deal
+
+    async def delete_deal(self, chat_id):
+        await self.write(self.store.delete_deal, chat_id)
+
+    async def create_deal(self, deal_data, replace_stages=()):
+        return await self.write(self.store.create_deal, deal_data, replace_stages)
+
+    async def compare_and_set_stage(self, chat_id, from_stages, to_stage, updates=None):
+        return await self.write(self.store.compare_and_set_stage, chat_id, from_stages, to_stage, updates)
+
+    async def delete_deal_if_stage(self, chat_id, from_stages):
+        return await self.write(self.store.delete_deal_if_stage, chat_id, from_stages)
+
+    async def compare_and_set_stages(self, chat_ids, from_stages, to_stage):
+        return await self.write(self.store.compare_and_set_stages, chat_ids, from_stages, to_stage)
+
+    async def delete_deals_if_stage(self, chat_ids, from_stages):
+        return await self.write(self.store.delete_deals_if_stage, chat_ids, from_stages)
+
+    async def count_deals_by_stage(self):
+        return await self.read(self.store.count_deals_by_stage)
+
+    async def get_all_deals(self):
+        return await self.read(self.store.get_all_deals)
+
+    async def get_deals_for_user(self, user_id):
+        return await self.read(self.store.get_deals_for_user, user_id)
+
+    async def get_deals_in_stage(self, stage, limit=None):
+        return await self.read(self.store.get_deals_in_stage, stage, limit)
+
+    async def get_deals_page(self, after_chat_id=None, limit=50, stage=None):
+        return await self.read(self.store.get_deals_page, after_chat_id, limit, stage)
+
+    async def iter_deals(self, stage=None, page_size=PAGE_SIZE):
+        """Async counterpart of Storage.iter_deals; one reader hop per page."""
+        after_chat_id = None
+        while True:
+            page = await self.get_deals_page(after_chat_id, page_size, stage)
+            for deal in page:
+                yield deal
+            if len(page) < page_size:
+                return
+            after_chat_id = page[-1]['chat_id']
+
+    # --- User Languages ---
+    async def save_user_language(self, user_id, language):
+        await self.write(self.store.save_user_language, user_id, language)
+
+    async def get_user_language(self, user_id):
+        language = self.store.cached_user_language(user_id)
+        if language is MISSING:
+            return await self.read(self.store.load_user_language, user_id)
+        return language
@@ -0,0 +1,98 @@
+"""Deal fan-out under Telegram flood limits: direct sends vs OutboundScheduler.
+
+Many deals finish at once. Each one sends two group messages, an admin DM
+and an announcement to the verification group. Runs offline against
+FakeBot; times are reported in simulated Telegram seconds.
+
+Usage: python benchmarks/bench_outbound.py [--deals 100] [--speedup 50]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telegram.error import RetryAfter  # noqa: E402
+
+import outbound  # noqa: E402
+from fake_bot import FakeBot  # noqa: E402
+
+ADMIN_ID = 42
+VERIFICATION_GROUP_ID = -1002583803584
+
+
+def fan_out(deals):
+    """(chat_id, text, priority) for every message the finishing deals send."""
+    messages = []
+    for i in range(deals):
+        group = -1001000000000 - i
+        messages.append((group, f'deal {i}: released', outbound.PRIORITY_CHAT))
+        messages.append((ADMIN_ID, f'deal {i}: admin_release_notification', outbound.PRIORITY_ADMIN))
+        messages.append((group, f'deal {i}: seller_final_confirm_prompt', outbound.PRIORITY_CHAT))
+        messages.append((VERIFICATION_GROUP_ID, f'deal {i}: deal_complete_announcement', outbound.PRIORITY_ANNOUNCEMENT))
+    return messages
+
+
+async def send_direct(bot, messages):
+    """What handlers do today: await each send, sleeping out any RetryAfter."""
+    async def deal_sends(batch):
+        for chat_id, text, _ in batch:
+            while True:
+                try:
+                    await bot.send_message(chat_id=chat_id, text=text)
+                    break
+                except RetryAfter as error:
+                    await asyncio.sleep(error.retry_after)
+    await asyncio.gather(*(deal_sends(messages[i:i + 4]) for i in range(0, len(messages), 4)))
+
+
+async def send_scheduled(bot, messages, speedup):
+    scheduler = outbound.OutboundScheduler(
+        bot,
+        global_rate=outbound.GLOBAL_RATE * speedup,
+        private_rate=outbound.PRIVATE_RATE * speedup,
+        group_rate=outbound.GROUP_RATE * speedup,
+    )
+    for chat_id, text, priority in messages:
+        scheduler.send_message(chat_id, text, priority)
+    await scheduler.stop()
+
+
+def report(label, bot, messages, started, speedup):
+    priority_of = {text: priority for _, text, priority in messages}
+    done = {outbound.PRIORITY_ADMIN: [], outbound.PRIORITY_CHAT: [], outbound.PRIORITY_ANNOUNCEMENT: []}
+    for _, text, at in bot.delivered:
+        done[priority_of[text]].append((at - started) * speedup)
+    total = max(max(times) for times in done.values() if times)
+
+    def p(times, pct):
+        times = sorted(times)
+        return times[min(len(times) - 1, int(len(times) * pct / 100))]
+
+    admin, chat, announce = (done[k] for k in sorted(done))
+    print(f'{label:<10} {total:>8.1f} {len(messages) / total:>7.2f} {bot.flood_errors:>6} '
+          f'{p(admin, 50):>8.1f} {max(admin):>8.1f} {p(chat, 50):>8.1f} {p(chat, 99):>8.1f} {max(announce):>9.1f}')
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--deals', type=int, default=100)
+    parser.add_argument('--speedup', type=float, default=50.0, help='simulated seconds per real second')
+    args = parser.parse_args()
+    messages = fan_out(args.deals)
+
+    print(f'{args.deals} deals, {len(messages)} messages (times in simulated seconds)')
+    print(f"{'mode':<10} {'total':>8} {'msg/s':>7} {'429s':>6} {'admin50':>8} {'adminmax':>8} "
+          f"{'group50':>8} {'group99':>8} {'announce':>9}")
+    for label, run in (('direct', lambda bot: send_direct(bot, messages)),
+                       ('scheduled', lambda bot: send_scheduled(bot, messages, args.speedup))):
+        bot = FakeBot(speedup=args.speedup)
+        started = time.monotonic()
+        await run(bot)
+        report(label, bot, messages, started, args.speedup)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
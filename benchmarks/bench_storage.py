@@ -0,0 +1,156 @@
+"""Calls per second: per-call sqlite3.connect helpers vs the pooled Storage.
+
+The pooled Storage runs with and without its cache; the speedup column
+compares the uncached one, so it is not inflated by cache hits.
+
+Usage: python benchmarks/bench_storage.py [--iterations N]
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from storage import Storage  # noqa: E402
+
+
+# --- Per-call-connect helpers, as main.py used to have them ---
+class LegacyStore:
+    def __init__(self, db_name):
+        self.db_name = db_name
+
+    def init_schema(self):
+        with sqlite3.connect(self.db_name) as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS deals (
+                    chat_id INTEGER PRIMARY KEY,
+                    buyer_id INTEGER,
+                    buyer_username TEXT,
+                    buyer_address TEXT,
+                    seller_id INTEGER,
+                    seller_username TEXT,
+                    seller_account TEXT,
+                    stage TEXT
+                )
+            ''')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS user_languages (
+                    user_id INTEGER PRIMARY KEY,
+                    language TEXT DEFAULT 'HA'
+                )
+            ''')
+            conn.commit()
+
+    def save_deal(self, deal_data):
+        with sqlite3.connect(self.db_name) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT OR REPLACE INTO deals (chat_id, buyer_id, buyer_username, buyer_address, seller_id, seller_username, seller_account, stage)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (
+                deal_data['chat_id'], deal_data['buyer_id'], deal_data['buyer_username'], deal_data['buyer_address'],
+                deal_data.get('seller_id'), deal_data.get('seller_username'), deal_data.get('seller_account'), deal_data['stage']
+            ))
+            conn.commit()
+
+    def get_deal(self, chat_id):
+        with sqlite3.connect(self.db_name) as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT * FROM deals WHERE chat_id = ?', (chat_id,))
+            row = cursor.fetchone()
+            if row:
+                columns = [description[0] for description in cursor.description]
+                return dict(zip(columns, row))
+            return None
+
+    def save_user_language(self, user_id, language):
+        with sqlite3.connect(self.db_name) as conn:
+            cursor = conn.cursor()
+            cursor.execute('INSERT OR REPLACE INTO user_languages (user_id, language) VALUES (?, ?)', (user_id, language))
+            conn.commit()
+
+    def get_user_language(self, user_id):
+        with sqlite3.connect(self.db_name) as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT language FROM user_languages WHERE user_id = ?', (user_id,))
+            result = cursor.fetchone()
+            return result[0] if result else 'HA'
+
+    def close(self):
+        pass
+
+
+def make_deal(i):
+    return {
+        'chat_id': -1000000000000 - i,
+        'buyer_id': 1000 + i,
+        'buyer_username': f'buyer{i}',
+        'buyer_address': 'TRjqMH6ckyNVaCBXNDkKitq1phCV1YSugg',
+        'seller_id': 2000 + i,
+        'seller_username': f'seller{i}',
+        'seller_account': 'Opay 9131085651',
+        'stage': 'awaiting_payment',
+    }
+
+
+def run(store, iterations):
+    results = {}
+    deals = [make_deal(i % 500) for i in range(iterations)]
+
+    start = time.perf_counter()
+    for deal in deals:
+        store.save_deal(deal)
+    results['save_deal'] = iterations / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for deal in deals:
+        store.get_deal(deal['chat_id'])
+    results['get_deal'] = iterations / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for i in range(iterations):
+        store.save_user_language(i % 500, 'EN' if i % 2 else 'HA')
+    results['save_user_language'] = iterations / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for i in range(iterations):
+        store.get_user_language(i % 500)
+    results['get_user_language'] = iterations / (time.perf_counter() - start)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=2000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy = LegacyStore(os.path.join(tmp, 'legacy.db'))
+        # Without the cache the reads go to SQLite, so this column shows what
+        # the pooled connection alone buys; the cached one mostly measures hits
+        uncached = Storage(os.path.join(tmp, 'uncached.db'), cache_max_bytes=0)
+        pooled = Storage(os.path.join(tmp, 'pooled.db'))
+        stores = (('per-call connect', legacy), ('pooled, no cache', uncached), ('pooled + cache', pooled))
+        rows = {}
+        for label, store in stores:
+            store.init_schema()
+            rows[label] = run(store, args.iterations)
+            store.close()
+        cache_stats = pooled.cache_stats()
+
+    print(f"{'operation':<20}" + ''.join(f' {label:>18}' for label, _ in stores) + f" {'speedup':>9}")
+    for op in rows['per-call connect']:
+        before, after = rows['per-call connect'][op], rows['pooled, no cache'][op]
+        print(f'{op:<20}' + ''.join(f' {rows[label][op]:>16.0f}/s' for label, _ in stores) +
+              f' {after / before:>8.1f}x')
+    for name, stats in cache_stats.items():
+        if stats:
+            print(f"{name} cache: {stats['hits']} hits, {stats['misses']} misses, "
+                  f"{stats['evictions']} evictions, {stats['bytes']} bytes")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+"""Offline stand-in for telegram.Bot that enforces Telegram-like flood limits.
+
+Calls sleep for a simulated network latency and raise RetryAfter when a
+chat or the bot as a whole goes over its limit, like the real API does.
+`speedup` compresses time: limits are multiplied and latencies divided by it.
+"""
+import asyncio
+import itertools
+import random
+import time
+from types import SimpleNamespace
+
+from telegram.error import RetryAfter
+
+import outbound
+
+
+class _Limit:
+    def __init__(self, rate, burst):
+        self.bucket = outbound.TokenBucket(rate, burst)
+
+    def take(self):
+        delay = self.bucket.delay()
+        if delay > 0:
+            return delay
+        self.bucket.consume()
+        return 0
+
+
+class FakeBot:
+    def __init__(self, speedup=1.0, latency=(0.04, 0.12), seed=1):
+        self.speedup = speedup
+        self.latency = latency
+        self.rng = random.Random(seed)
+        # A little more lenient than what the scheduler aims for, like the real API
+        self._global = _Limit(outbound.GLOBAL_RATE * speedup, outbound.GLOBAL_BURST)
+        self._chats = {}
+        self._message_ids = itertools.count(1)
+        self.calls = 0
+        self.flood_errors = 0
+        self.delivered = []  # (chat_id, text, monotonic time)
+
+    def _chat_limit(self, chat_id):
+        limit = self._chats.get(chat_id)
+        if limit is None:
+            if chat_id < 0:
+                limit = _Limit(outbound.GROUP_RATE * self.speedup, outbound.GROUP_BURST + 2)
+            else:
+                limit = _Limit(outbound.PRIVATE_RATE * self.speedup, outbound.PRIVATE_BURST + 2)
+            self._chats[chat_id] = limit
+        return limit
+
+    async def _call(self, chat_id, text):
+        self.calls += 1
+        await asyncio.sleep(self.rng.uniform(*self.latency) / self.speedup)
+        wait = max(self._chat_limit(chat_id).take(), self._global.take())
+        if wait > 0:
+            self.flood_errors += 1
+            raise RetryAfter(max(wait, 1 / self.speedup))
+        self.delivered.append((chat_id, text, time.monotonic()))
+        return SimpleNamespace(chat_id=chat_id, message_id=next(self._message_ids), text=text)
+
+    async def send_message(self, chat_id, text, **kwargs):
+        return await self._call(chat_id, text)
+
+    async def edit_message_text(self, text, chat_id=None, message_id=None, **kwargs):
+        return await self._call(chat_id, text)
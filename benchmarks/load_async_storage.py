@@ -0,0 +1,108 @@
+"""Handler latency under many concurrent group chats: blocking vs async storage.
+
+Every simulated group fires callback-query handlers at random moments; each
+handler reads the user's language and the deal, moves the stage on and saves
+it, like the real button handlers do. Latency is measured from the moment a
+tap arrives until its handler finishes.
+
+Usage: python benchmarks/load_async_storage.py [--chats 300] [--taps 5]
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from async_storage import AsyncStorage  # noqa: E402
+from bench_storage import LegacyStore, make_deal  # noqa: E402
+from storage import Storage  # noqa: E402
+
+STAGES = ('awaiting_payment', 'payment_sent', 'funds_confirmed', 'delivered', 'released')
+
+
+def blocking_handler(store):
+    async def handle(chat_id, user_id):
+        store.get_user_language(user_id)
+        deal = store.get_deal(chat_id)
+        deal['stage'] = STAGES[(STAGES.index(deal['stage']) + 1) % len(STAGES)]
+        store.save_deal(deal)
+    return handle
+
+
+def async_handler(astore):
+    async def handle(chat_id, user_id):
+        await astore.get_user_language(user_id)
+        deal = await astore.get_deal(chat_id)
+        deal['stage'] = STAGES[(STAGES.index(deal['stage']) + 1) % len(STAGES)]
+        await astore.save_deal(deal)
+    return handle
+
+
+async def simulate(handle, chats, taps, spread):
+    rng = random.Random(42)
+    latencies = []
+
+    async def tap(chat_id, user_id, arrival):
+        # A blocked event loop wakes us late; that wait counts as latency too.
+        await asyncio.sleep(max(0.0, arrival - time.perf_counter()))
+        await handle(chat_id, user_id)
+        latencies.append(time.perf_counter() - arrival)
+
+    start = time.perf_counter()
+    tasks = []
+    for i in range(chats):
+        chat_id = make_deal(i)['chat_id']
+        for _ in range(taps):
+            tasks.append(tap(chat_id, 1000 + i, start + rng.uniform(0, spread)))
+    await asyncio.gather(*tasks)
+    return latencies
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def seed(store, chats):
+    store.init_schema()
+    for i in range(chats):
+        store.save_deal(make_deal(i))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--chats', type=int, default=300)
+    parser.add_argument('--taps', type=int, default=5, help='callback queries per chat')
+    parser.add_argument('--spread', type=float, default=2.0, help='seconds over which taps arrive')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy = LegacyStore(os.path.join(tmp, 'legacy.db'))
+        seed(legacy, args.chats)
+        pooled = Storage(os.path.join(tmp, 'pooled.db'))
+        seed(pooled, args.chats)
+        astore = AsyncStorage(Storage(os.path.join(tmp, 'pooled.db')))
+
+        runs = (
+            ('blocking, per-call connect', blocking_handler(legacy)),
+            ('blocking, pooled', blocking_handler(pooled)),
+            ('async, batched writes', async_handler(astore)),
+        )
+        print(f'{args.chats} chats x {args.taps} taps over {args.spread:.1f}s')
+        print(f"{'mode':<28} {'p50 ms':>8} {'p99 ms':>8} {'mean ms':>8}")
+        for label, handle in runs:
+            latencies = asyncio.run(simulate(handle, args.chats, args.taps, args.spread))
+            print(f'{label:<28} {percentile(latencies, 50) * 1000:>8.2f} '
+                  f'{percentile(latencies, 99) * 1000:>8.2f} {statistics.mean(latencies) * 1000:>8.2f}')
+        astore.close()
+        astore.store.close()
+        pooled.close()
+
+
+if __name__ == '__main__':
+    main()
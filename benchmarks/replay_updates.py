@@ -0,0 +1,252 @@
+"""Replays Update JSON through the webhook dispatch path at 1, 2, 4... workers.
+
+Every update goes through webhook.Dispatcher and then a worker process's PTB
+Application, exactly as it would from the webhook. The handlers do a deal's
+real storage, state-machine and catalog work. Bot API calls are answered
+locally by ReplayRequest, so nothing leaves the machine. Synthetic traffic is
+many groups each running one whole deal, interleaved. Buyers are shared
+between groups, so language changes cross shards. A deal only reaches
+COMPLETE if its updates were handled in order. Pass --input to replay
+recorded updates instead (one Update JSON object per line).
+
+Usage: python benchmarks/replay_updates.py [--groups 500] [--workers 1 2 4]
+       [--input updates.jsonl] [--record updates.jsonl]
+"""
+import argparse
+import functools
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('ADMIN_ID', '42')  # main.py insists on one; nothing is sent to it
+
+from telegram.ext import ApplicationBuilder, CallbackQueryHandler, CommandHandler  # noqa: E402
+from telegram.request import BaseRequest  # noqa: E402
+
+import main as bot  # noqa: E402
+import outbound  # noqa: E402
+import state_machine  # noqa: E402
+import webhook  # noqa: E402
+from async_storage import AsyncStorage  # noqa: E402
+from storage import Storage  # noqa: E402
+
+ADMIN_ID = int(os.environ['ADMIN_ID'])
+BOT_ID = 777000
+FIRST_GROUP = -1001000000000
+
+# event -> (group message, group keyboard, admin message, admin keyboard)
+REPLIES = {
+    'buyer_paid': ('buyer_paid_confirm', None, 'admin_payment_notification', 'admin_payment'),
+    'admin_confirm': ('admin_notified_seller_delivery', 'seller_delivery', None, None),
+    'seller_delivered': ('buyer_confirm_receipt_prompt', 'buyer_receipt', None, None),
+    'buyer_received': ('deal_complete_awaiting_admin_release', None, 'admin_release_notification', 'admin_release'),
+    'admin_release': ('seller_final_confirm_prompt', 'seller_final', None, None),
+    'seller_final_received': ('deal_successfully_completed', None, None, None),
+}
+
+
+# --- Offline Bot API ---
+class ReplayRequest(BaseRequest):
+    """Answers Bot API calls locally with just enough JSON for PTB to parse."""
+
+    def __init__(self):
+        self.message_id = 0
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None,
+                         write_timeout=None, connect_timeout=None, pool_timeout=None):
+        endpoint = url.rsplit('/', 1)[-1]
+        params = request_data.parameters if request_data is not None else {}
+        if endpoint == 'getMe':
+            result = {'id': BOT_ID, 'is_bot': True, 'first_name': 'Escrow', 'username': 'ReplayEscrowBot'}
+        elif endpoint in ('sendMessage', 'editMessageText'):
+            self.message_id += 1
+            result = {'message_id': params.get('message_id', self.message_id), 'date': int(time.time()),
+                      'chat': {'id': int(params['chat_id']), 'type': 'private'}, 'text': params.get('text', '')}
+        else:
+            result = True
+        return 200, json.dumps({'ok': True, 'result': result}).encode()
+
+
+# --- Worker Application ---
+def build_application(db_path, worker, workers):
+    """The webhook factory for the replay: wired like a real multi-worker deployment."""
+    store = Storage(db_path, cache_max_bytes=0 if workers > 1 else bot.CACHE_MAX_KB * 1024)
+    async_store = AsyncStorage(store)
+    catalog = bot.catalog
+    application = (ApplicationBuilder().token(f'{BOT_ID}:replay')
+                   .request(ReplayRequest()).get_updates_request(ReplayRequest())
+                   .updater(None).build())
+    # Flood limits are bench_outbound.py's subject; here they would only cap the rate
+    scheduler = outbound.attach(application, global_rate=1e6, private_rate=1e6, group_rate=1e6,
+                                global_burst=10**6, private_burst=10**6, group_burst=10**6)
+    application.bot_data['conflicts'] = 0
+
+    async def language(update, context):
+        code = context.args[0].upper() if context.args else 'HA'
+        await async_store.save_user_language(update.effective_user.id, code)
+        scheduler.send_message(update.effective_chat.id, catalog.render(code, f'language_set_{code.lower()}'))
+
+    async def buyer(update, context):
+        user = update.effective_user
+        lang = await async_store.get_user_language(user.id)
+        result = await state_machine.open_deal_async(async_store, {
+            'chat_id': update.effective_chat.id, 'buyer_id': user.id,
+            'buyer_username': user.username, 'buyer_address': ' '.join(context.args),
+        })
+        key = 'buyer_address_received' if result.ok else 'buyer_not_set_address_or_deal_started'
+        scheduler.send_message(update.effective_chat.id, catalog.render(lang, key))
+
+    async def seller(update, context):
+        user = update.effective_user
+        lang = await async_store.get_user_language(user.id)
+        result = await state_machine.fire_async(async_store, update.effective_chat.id, 'seller_joined',
+                                                seller_id=user.id, seller_username=user.username,
+                                                seller_account=' '.join(context.args))
+        if result.conflict:
+            context.bot_data['conflicts'] += 1
+            scheduler.send_message(update.effective_chat.id, catalog.render(lang, 'no_deal_or_stage_mismatch'))
+            return
+        text = catalog.render(lang, 'seller_details_received_notify_buyer', result.deal,
+                              escrow_trc20_address='T...', escrow_naira_bank='Opay')
+        scheduler.send_message(update.effective_chat.id, text, reply_markup=catalog.keyboard(lang, 'buyer_payment'))
+
+    async def button(update, context):
+        query = update.callback_query
+        event, _, deal_chat = query.data.partition(':')
+        chat_id = int(deal_chat) if deal_chat else query.message.chat.id
+        lang = await async_store.get_user_language(query.from_user.id)
+        result = await state_machine.fire_async(async_store, chat_id, event)
+        await query.answer()
+        if result.conflict:
+            context.bot_data['conflicts'] += 1
+            scheduler.send_message(chat_id, catalog.render(lang, 'no_deal_or_stage_mismatch'))
+            return
+        group_key, group_keyboard, admin_key, admin_keyboard = REPLIES[event]
+        markup = catalog.keyboard(lang, group_keyboard) if group_keyboard else None
+        scheduler.send_message(chat_id, catalog.render(lang, group_key, result.deal), reply_markup=markup)
+        if admin_key:
+            scheduler.send_message(ADMIN_ID, catalog.render(lang, admin_key, result.deal), outbound.PRIORITY_ADMIN,
+                                   reply_markup=catalog.keyboard(lang, admin_keyboard, chat_id=chat_id))
+
+    application.add_handlers([
+        CommandHandler('language', language),
+        CommandHandler('buyer', buyer),
+        CommandHandler('seller', seller),
+        CallbackQueryHandler(button),
+    ])
+    previous = application.post_shutdown
+
+    async def post_shutdown(app):
+        if previous is not None:
+            await previous(app)
+        if app.bot_data['conflicts']:
+            print(f'  worker {worker}: {app.bot_data["conflicts"]} update(s) hit a stage conflict')
+        async_store.close()
+        store.close()
+
+    application.post_shutdown = post_shutdown
+    return application
+
+
+# --- Synthetic Traffic ---
+def synthetic_updates(groups, buyers=None):
+    """Update JSON for `groups` whole deals, interleaved step by step across groups."""
+    buyers = buyers or max(1, groups // 4)
+    update_ids = iter(range(1, 10**9))
+    message_ids = iter(range(1, 10**9))
+
+    def user(user_id):
+        return {'id': user_id, 'is_bot': False, 'first_name': f'u{user_id}', 'username': f'user{user_id}'}
+
+    def chat(chat_id):
+        return {'id': chat_id, 'type': 'private' if chat_id > 0 else 'supergroup'}
+
+    def message(chat_id, user_id, text):
+        command = text.split()[0]
+        return {'update_id': next(update_ids), 'message': {
+            'message_id': next(message_ids), 'date': 0, 'chat': chat(chat_id), 'from': user(user_id),
+            'text': text, 'entities': [{'type': 'bot_command', 'offset': 0, 'length': len(command)}],
+        }}
+
+    def tap(chat_id, user_id, data):
+        return {'update_id': next(update_ids), 'callback_query': {
+            'id': str(next(update_ids)), 'from': user(user_id), 'chat_instance': str(chat_id), 'data': data,
+            'message': {'message_id': next(message_ids), 'date': 0, 'chat': chat(chat_id), 'text': '...'},
+        }}
+
+    def deal(i):
+        group = FIRST_GROUP - i
+        buyer = 1000 + i % buyers
+        seller = 500000 + i
+        return [
+            message(group, buyer, f'/language {"EN" if i % 2 else "HA"}'),
+            message(group, buyer, f'/buyer TRjq{i:06d}'),
+            message(group, seller, f'/seller Opay 91310{i:05d}'),
+            tap(group, buyer, 'buyer_paid'),
+            tap(ADMIN_ID, ADMIN_ID, f'admin_confirm:{group}'),
+            tap(group, seller, 'seller_delivered'),
+            tap(group, buyer, 'buyer_received'),
+            tap(ADMIN_ID, ADMIN_ID, f'admin_release:{group}'),
+            tap(group, seller, 'seller_final_received'),
+        ]
+
+    scripts = [deal(i) for i in range(groups)]
+    return [step for steps in zip(*scripts) for step in steps]
+
+
+# --- Runner ---
+def replay(updates, workers):
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'replay.db')
+        Storage(db_path).init_schema()  # once, before any worker starts, like webhook.run's prepare
+        dispatcher = webhook.Dispatcher(functools.partial(build_application, db_path), workers)
+        dispatcher.start()
+        started = time.perf_counter()
+        for data in updates:
+            dispatcher.dispatch(data)
+        dispatcher.stop()
+        elapsed = time.perf_counter() - started
+        store = Storage(db_path)
+        stages = store.count_deals_by_stage()
+        store.close()
+    return elapsed, stages, dispatcher.dispatched
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--groups', type=int, default=500)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--input', help='JSONL file of recorded Update JSON to replay')
+    parser.add_argument('--record', help='write the synthetic updates to this JSONL file and exit')
+    args = parser.parse_args()
+
+    if args.input:
+        with open(args.input, encoding='utf-8') as f:
+            updates = [json.loads(line) for line in f if line.strip()]
+    else:
+        updates = synthetic_updates(args.groups)
+    if args.record:
+        with open(args.record, 'w', encoding='utf-8') as f:
+            f.writelines(json.dumps(update) + '\n' for update in updates)
+        print(f'wrote {len(updates)} updates to {args.record}')
+        return
+
+    print(f'{len(updates)} updates, {os.cpu_count()} CPU(s)')
+    print(f"{'workers':>7} {'seconds':>8} {'updates/s':>10} {'complete':>9}  per-worker updates")
+    for workers in args.workers:
+        elapsed, stages, dispatched = replay(updates, workers)
+        print(f'{workers:>7} {elapsed:>8.2f} {len(updates) / elapsed:>10.0f} '
+              f'{stages.get(state_machine.COMPLETE, 0):>9}  {dispatched}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+MISSING = object()  # returned by get() on a miss, since None is a valid cached value
+
+ENTRY_OVERHEAD = 120  # bytes for the OrderedDict node, expiry tuple and bookkeeping
+
+
+def estimate_size(key, value):
+    """Rough memory footprint of one cache entry, in bytes."""
+    size = ENTRY_OVERHEAD + sys.getsizeof(key) + sys.getsizeof(value)
+    if isinstance(value, dict):
+        for k, v in value.items():
+            size += sys.getsizeof(k) + sys.getsizeof(v)
+    return size
+
+
+class LRUCache:
+    """Thread-safe LRU cache with a TTL and an approximate memory cap."""
+
+    def __init__(self, max_entries=5000, max_bytes=1024 * 1024, ttl=300):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (value, expires_at, size)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        """Returns the cached value, or MISSING."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return MISSING
+            if entry[1] < time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return MISSING
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value):
+        """Stores a value, evicting least recently used entries to stay in budget."""
+        size = estimate_size(key, value)
+        with self._lock:
+            self._store(key, value, size)
+
+    def add(self, key, value):
+        """Stores a value only if the key is not cached already.
+
+        Used when filling the cache from a DB read, so a read that raced with a
+        write cannot overwrite the fresher value the write put in.
+        """
+        size = estimate_size(key, value)
+        with self._lock:
+            if key not in self._entries:
+                self._store(key, value, size)
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def _store(self, key, value, size):
+        if key in self._entries:
+            self._remove(key)
+        if size > self.max_bytes or self.max_entries <= 0:
+            return
+        self._entries[key] = (value, time.monotonic() + self.ttl, size)
+        self._bytes += size
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+    def _remove(self, key):
+        self._bytes -= self._entries.pop(key)[2]
+
+    def stats(self):
+        """Returns the counters and current size."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,223 @@
+import json
+import logging
+import os
+import string
+import time
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# --- Inline Keyboards ---
+# name -> rows of (message key for the label, callback_data). Keyboards whose
+# callback_data has no placeholder are built once per language; the admin ones
+# carry the deal's chat_id and are assembled per call from the cached labels.
+KEYBOARDS = {
+    'buyer_payment': (
+        (('i_sent_funds_button', 'buyer_paid'),),
+        (('i_did_not_send_button', 'buyer_not_paid'),),
+    ),
+    'seller_delivery': (
+        (('seller_delivered_button', 'seller_delivered'),),
+        (('seller_not_delivered_dispute_button', 'seller_not_delivered'),),
+    ),
+    'buyer_receipt': (
+        (('buyer_received_button', 'buyer_received'),),
+        (('buyer_not_received_dispute_button', 'buyer_not_received'),),
+    ),
+    'seller_final': (
+        (('seller_final_received_button', 'seller_final_received'),),
+        (('seller_final_not_received_button', 'seller_final_not_received'),),
+    ),
+    'back_to_main_menu': (
+        (('back_to_main_menu_button', 'main_menu'),),
+    ),
+    'admin_payment': (
+        (('funds_received_button', 'admin_confirm:{chat_id}'),),
+        (('not_received_cancel_button', 'admin_cancel:{chat_id}'),),
+    ),
+    'admin_release': (
+        (('release_funds_button', 'admin_release:{chat_id}'),),
+        (('stop_trade_button', 'admin_cancel:{chat_id}'),),
+    ),
+}
+
+_formatter = string.Formatter()
+LANGUAGE_CODE_MAX = 8  # longest code looked up in locales_dir
+MISSING_MAX = 256      # unknown codes remembered, so each is only looked for once
+
+
+class CatalogError(ValueError):
+    """Raised when a language's messages do not match the reference language."""
+
+
+def language_code(language):
+    """Returns language as an upper-case code if it is one (letters only), else None.
+
+    Codes become file names in locales_dir, so anything else, e.g. '../x', is refused.
+    """
+    if isinstance(language, str) and language.isascii() and language.isalpha() \
+            and len(language) <= LANGUAGE_CODE_MAX:
+        return language.upper()
+    return None
+
+
+def placeholders(template):
+    """Returns the set of field names used by a str.format template."""
+    return {field for _, field, _, _ in _formatter.parse(template) if field is not None}
+
+
+def compile_template(template):
+    """Turns a str.format template into a fast render(values) callable.
+
+    Plain "{name}" fields are rewritten to printf-style "%(name)s", which is
+    formatted in C without re-parsing the template on every call. Templates
+    using format specs, conversions or attribute access keep str.format_map.
+    """
+    parts = []
+    for literal, field, spec, conversion in _formatter.parse(template):
+        parts.append(literal.replace('%', '%%'))
+        if field is None:
+            continue
+        if spec or conversion or not field.isidentifier():
+            return template.format_map
+        parts.append(f'%({field})s')
+    compiled = ''.join(parts)
+    if '%(' not in compiled:
+        text = compiled.replace('%%', '%')
+        return lambda values=None: text
+    return compiled.__mod__
+
+
+class Catalog:
+    """Validated, precompiled messages and keyboards for every language."""
+
+    def __init__(self, messages, default_language='HA', locales_dir=None, keyboards=KEYBOARDS):
+        self.default_language = default_language
+        self.locales_dir = locales_dir
+        self.keyboards = keyboards
+        self._reference = messages[default_language]
+        self._placeholders = {key: placeholders(text) for key, text in self._reference.items()}
+        self._languages = {}
+        self._missing = set()
+
+        for name, rows in keyboards.items():
+            for row in rows:
+                for label_key, _ in row:
+                    if label_key not in self._reference:
+                        raise CatalogError(f"keyboard '{name}' uses unknown message '{label_key}'")
+        # Built-in languages are checked up front so a bad edit fails at startup
+        for language, texts in messages.items():
+            self._languages[language] = self._compile(language, texts)
+
+    def validate(self, language, texts):
+        """Raises CatalogError unless texts has the reference keys and placeholders."""
+        problems = []
+        missing = self._reference.keys() - texts.keys()
+        extra = texts.keys() - self._reference.keys()
+        if missing:
+            problems.append(f"missing keys: {', '.join(sorted(missing))}")
+        if extra:
+            problems.append(f"unknown keys: {', '.join(sorted(extra))}")
+        for key in self._reference.keys() & texts.keys():
+            found = placeholders(texts[key])
+            if found != self._placeholders[key]:
+                expected = ', '.join(sorted(self._placeholders[key])) or 'none'
+                problems.append(f"'{key}' has placeholders {', '.join(sorted(found)) or 'none'}, expected {expected}")
+        if problems:
+            raise CatalogError(f'language {language}: ' + '; '.join(problems))
+
+    def _compile(self, language, texts):
+        self.validate(language, texts)
+        keyboards = {}
+        for name, rows in self.keyboards.items():
+            if any('{' in data for row in rows for _, data in row):
+                continue
+            keyboards[name] = InlineKeyboardMarkup([
+                [InlineKeyboardButton(texts[label_key], callback_data=data) for label_key, data in row]
+                for row in rows
+            ])
+        return {
+            'texts': texts,
+            'renderers': {key: compile_template(text) for key, text in texts.items()},
+            'keyboards': keyboards,
+        }
+
+    def _language(self, language):
+        compiled = self._languages.get(language)
+        if compiled is not None:
+            return compiled
+        code = language_code(language)
+        if code is None:
+            # Not recorded in _missing: arbitrary input must not grow it
+            logger.warning("Invalid language code %r, falling back to %s", language, self.default_language)
+            return self._languages[self.default_language]
+        compiled = self._languages.get(code)
+        if compiled is not None:
+            return compiled
+        if code not in self._missing:
+            try:
+                texts = self._load_file(code)
+                if texts is not None:
+                    compiled = self._languages[code] = self._compile(code, texts)
+                    return compiled
+            except (OSError, ValueError) as error:
+                # Broken JSON or a failed validation (CatalogError): one bad file
+                # must not break every reply to the users who picked that language
+                logger.error("Ignoring messages for language %s, falling back to %s: %s",
+                             code, self.default_language, error)
+            if len(self._missing) < MISSING_MAX:
+                self._missing.add(code)
+        return self._languages[self.default_language]
+
+    def _load_file(self, language):
+        if not self.locales_dir:
+            return None
+        path = os.path.join(self.locales_dir, f'{language}.json')
+        if not os.path.isfile(path):
+            logger.warning("No messages for language %s, falling back to %s", language, self.default_language)
+            return None
+        with open(path, encoding='utf-8') as f:
+            texts = json.load(f)
+        if not isinstance(texts, dict):
+            raise CatalogError(f'{path} must hold a JSON object of messages')
+        return texts
+
+    # --- Lookups ---
+    def has_language(self, language):
+        """Tells whether messages exist for the language, loading them if needed."""
+        self._language(language)
+        return language in self._languages or language_code(language) in self._languages
+
+    def text(self, language, key):
+        """Returns the raw template for a key."""
+        return self._language(language)['texts'][key]
+
+    def render(self, language, key, values=None, **kwargs):
+        """Fills a message's placeholders from values (e.g. a deal dict) and kwargs."""
+        if kwargs:
+            values = dict(values or {}, **kwargs)
+        elif values is None:
+            values = {}
+        started = time.perf_counter()
+        text = self._language(language)['renderers'][key](values)
+        metrics.RENDER_SECONDS.observe(time.perf_counter() - started)
+        return text
+
+    def keyboard(self, language, name, **values):
+        """Returns the InlineKeyboardMarkup for a keyboard in KEYBOARDS.
+
+        Static keyboards are shared objects built at load time; keyboards with
+        placeholders in their callback_data (e.g. {chat_id}) are built per call.
+        """
+        compiled = self._language(language)
+        markup = compiled['keyboards'].get(name)
+        if markup is not None:
+            return markup
+        texts = compiled['texts']
+        return InlineKeyboardMarkup([
+            [InlineKeyboardButton(texts[label_key], callback_data=data.format_map(values)) for label_key, data in row]
+            for row in self.keyboards[name]
+        ])
@@ -1,7 +1,7 @@
+import logging
 import os
 import random
 import string
-import sqlite3
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (
     ApplicationBuilder,
@@ -11,9 +11,21 @@ from telegram.ext import (
 )
 from dotenv import load_dotenv
 
+import admin_queue
+import metrics
+import migrations
+import outbound
+import state_machine
+import webhook
+from async_storage import AsyncStorage
+from catalog import Catalog
+from storage import Storage
+
 # Load environment variables from .env file
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 # --- Bot Configuration ---
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 ADMIN_ID = int(os.getenv("ADMIN_ID"))
@@ -23,94 +35,104 @@ VERIFICATION_GROUP_ID = -1002583803584  # Hausa Escrow Chat ID
 ESCROW_TRC20_ADDRESS = os.getenv("ESCROW_TRC20_ADDRESS")
 ESCROW_NAIRA_BANK = os.getenv("ESCROW_NAIRA_BANK")
 
+# --- Admin Queue Mode ---
+# When on, payment claims, disputes and releases are folded into one digest
+# message for the admin (edited in place) instead of one DM each
+ADMIN_QUEUE_MODE = os.getenv("ADMIN_QUEUE_MODE", "0") == "1"
+ADMIN_DIGEST_INTERVAL = int(os.getenv("ADMIN_DIGEST_INTERVAL", "15"))  # seconds
+
+# --- Metrics ---
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))  # Prometheus /metrics on 127.0.0.1; 0 = off
+PROFILE_OUTPUT = os.getenv("PROFILE_OUTPUT", "profile.txt")  # where /profile writes hot call paths
+
+# --- Webhook Mode ---
+# Set WEBHOOK_URL (the public https address, e.g. a tunnel to WEBHOOK_PORT) to
+# take updates by webhook with WEBHOOK_WORKERS processes, sharded by chat_id
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")  # checked on every update; a random one per run if unset
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "2"))
+
 # --- Database Configuration ---
 DB_NAME = 'escrow_bot.db'
+# Memory cap for the deal/language cache; keep it small on Termux phones (0 disables it)
+CACHE_MAX_KB = int(os.getenv("CACHE_MAX_KB", "1024"))
+CACHE_TTL = int(os.getenv("CACHE_TTL", "300"))  # seconds
+if WEBHOOK_URL and WEBHOOK_WORKERS > 1:
+    # Workers share the database but not memory: one worker's cache could hold a
+    # deal or language another worker has since changed, so SQLite is the only copy
+    CACHE_MAX_KB = 0
+
+# One long-lived WAL connection per thread instead of a connect/fsync per call,
+# with a write-through cache in front of the deals and user_languages tables
+store = Storage(DB_NAME, cache_max_bytes=CACHE_MAX_KB * 1024, cache_ttl=CACHE_TTL)
+# Awaitable variant for the async handlers: reads on a thread pool, writes
+# batched on one writer thread, so a slow commit never stalls the event loop
+async_store = AsyncStorage(store)
 
 def init_db():
-    """Initializes the SQLite database."""
-    with sqlite3.connect(DB_NAME) as conn:
-        cursor = conn.cursor()
-        # Create deals table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS deals (
-                chat_id INTEGER PRIMARY KEY,
-                buyer_id INTEGER,
-                buyer_username TEXT,
-                buyer_address TEXT,
-                seller_id INTEGER,
-                seller_username TEXT,
-                seller_account TEXT,
-                stage TEXT
-            )
-        ''')
-        # Create user_languages table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS user_languages (
-                user_id INTEGER PRIMARY KEY,
-                language TEXT DEFAULT 'HA'
-            )
-        ''')
-        conn.commit()
+    """Initializes the SQLite database, applying any pending migrations.
+
+    Schema changes are made before returning; row backfills continue on a
+    background thread while the bot serves.
+    """
+    report = store.init_schema(backfill=False)
+    logger.info("Database ready: %s", report)
+    migrations.start_backfills(store)
 
+@metrics.instrument_db
 def save_deal(deal_data):
     """Saves or updates a deal in the database."""
-    with sqlite3.connect(DB_NAME) as conn:
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT OR REPLACE INTO deals (chat_id, buyer_id, buyer_username, buyer_address, seller_id, seller_username, seller_account, stage)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            deal_data['chat_id'], deal_data['buyer_id'], deal_data['buyer_username'], deal_data['buyer_address'],
-            deal_data.get('seller_id'), deal_data.get('seller_username'), deal_data.get('seller_account'), deal_data['stage']
-        ))
-        conn.commit()
+    store.save_deal(deal_data)
 
+@metrics.instrument_db
 def get_deal(chat_id):
     """Retrieves a deal from the database."""
-    with sqlite3.connect(DB_NAME) as conn:
-        cursor = conn.cursor()
-        cursor.execute('SELECT * FROM deals WHERE chat_id = ?', (chat_id,))
-        row = cursor.fetchone()
-        if row:
-            # Map column names to values
-            columns = [description[0] for description in cursor.description]
-            return dict(zip(columns, row))
-        return None
+    return store.get_deal(chat_id)
 
+@metrics.instrument_db
 def delete_deal(chat_id):
     """Deletes a deal from the database."""
-    with sqlite3.connect(DB_NAME) as conn:
-        cursor = conn.cursor()
-        cursor.execute('DELETE FROM deals WHERE chat_id = ?', (chat_id,))
-        conn.commit()
+    store.delete_deal(chat_id)
 
+@metrics.instrument_db
 def get_all_deals():
     """Retrieves all deals from the database."""
-    with sqlite3.connect(DB_NAME) as conn:
-        cursor = conn.cursor()
-        cursor.execute('SELECT * FROM deals')
-        rows = cursor.fetchall()
-        deals_dict = {}
-        for row in rows:
-            columns = [description[0] for description in cursor.description]
-            deal_data = dict(zip(columns, row))
-            deals_dict[deal_data['chat_id']] = deal_data
-        return deals_dict
+    return store.get_all_deals()
+
+@metrics.instrument_db
+def get_deals_for_user(user_id):
+    """Retrieves the deals where the user is buyer or seller."""
+    return store.get_deals_for_user(user_id)
 
+@metrics.instrument_db
+def get_deals_in_stage(stage):
+    """Retrieves the deals currently in the given stage."""
+    return store.get_deals_in_stage(stage)
+
+@metrics.instrument_db
+def open_deal(deal_data):
+    """Starts a deal unless the group already has an open one."""
+    return state_machine.open_deal(store, deal_data)
+
+@metrics.instrument_db
+def transition_deal(chat_id, event, **updates):
+    """Moves a deal on by one event with a single compare-and-set write."""
+    return state_machine.fire(store, chat_id, event, **updates)
+
+def iter_deals(stage=None):
+    """Streams deals page by page for admin listings."""
+    return store.iter_deals(stage)
+
+@metrics.instrument_db
 def save_user_language(user_id, language):
     """Saves or updates a user's language preference."""
-    with sqlite3.connect(DB_NAME) as conn:
-        cursor = conn.cursor()
-        cursor.execute('INSERT OR REPLACE INTO user_languages (user_id, language) VALUES (?, ?)', (user_id, language))
-        conn.commit()
+    store.save_user_language(user_id, language)
 
+@metrics.instrument_db
 def get_user_language(user_id):
     """Retrieves a user's language preference, defaulting to Hausa."""
-    with sqlite3.connect(DB_NAME) as conn:
-        cursor = conn.cursor()
-        cursor.execute('SELECT language FROM user_languages WHERE user_id = ?', (user_id,))
-        result = cursor.fetchone()
-        return result[0] if result else 'HA' # Default to Hausa if not found
+    return store.get_user_language(user_id)
 
 # --- Multilingual Messages ---
 MESSAGES = {
@@ -197,7 +219,23 @@ MESSAGES = {
 
         "choose_language": "Please choose your language / Da fatan zaɓi yarenka:",
         "language_set_ha": "An saita yarenka.",
-        "language_set_en": "Your language has been set up."
+        "language_set_en": "Your language has been set up.",
+
+        "admin_digest_title": "📋 *Layin Admin* (an sabunta {time})",
+        "admin_digest_payment_sent": "💸 Ana jiran tabbatar da biya ({count}):",
+        "admin_digest_received": "📦 Ana jiran sakin kuɗi ({count}):",
+        "admin_digest_dispute": "⚠️ Rikice-rikice ({count}):",
+        "admin_digest_item": "• `{chat_id}` @{buyer_username} → @{seller_username}",
+        "admin_digest_more": "…da wasu {count}",
+        "admin_digest_empty": "✅ Babu abin da ke jiranka.",
+        "admin_digest_commands": "`/bulk_confirm all` · `/bulk_release all` · `/bulk_cancel chat_id`",
+        "admin_bulk_result": "✅ An sabunta {done}, an tsallake {skipped} (sun riga sun wuce wannan matakin ko babu su).",
+        "admin_bulk_usage": "Yadda ake amfani: `/{command} all` ko `/{command} chat_id ...`",
+        "admin_cancel_usage": "Yadda ake amfani: `/bulk_cancel chat_id ...`",
+
+        "stats_title": "📈 Ƙididdigar Bot",
+        "profiler_started": "🔬 An fara profiler. Sake aika /profile don tsayar da shi.",
+        "profiler_stopped": "🔬 An tsayar da profiler. An rubuta sakamako a {path}."
     },
     "EN": {
         "welcome": "⚜️ Hausa Escrow Bot ⚜️ v.1\n\nWelcome to Hausa Escrow Bot! This bot provides secure (escrow) services for your trades on Telegram. 🔒\n\n💰 *ESCROW FEES:*\n- 5% if the amount exceeds $100\n- $5 if it's less than $100\n\n🌟 *UPDATES - PROOF:*\n✅ COMPLETED TRADES: 0\n⚖️ DISPUTES RESOLVED: 0\n\n🛒 Type /buyer address or /seller account\n📜 Type /menu to see all features\n\n@HausaEscrowBot – For secure trading!",
@@ -277,4 +315,70 @@ MESSAGES = {
         "you_are_buyer": "You are the *buyer* in a trade in group: `{chat_id}`. Stage: *{stage}*.",
         "you_are_seller": "You are the *seller* in a trade in group: `{chat_id}`. Stage: *{stage}*.",
 
-        "deal_cancelled_message": "❗ Trade between @{buyer_username} and @{seller_usern
+        "deal_cancelled_message": "❗ Trade between @{buyer_username} and @{seller_username} has been stopped.",
+        "no_deal_to_cancel": "❗ There is no trade information here to cancel.",
+
+        "choose_language": "Please choose your language / Da fatan zaɓi yarenka:",
+        "language_set_ha": "An saita yarenka.",
+        "language_set_en": "Your language has been set up.",
+
+        "admin_digest_title": "📋 *Admin queue* (updated {time})",
+        "admin_digest_payment_sent": "💸 Awaiting payment confirmation ({count}):",
+        "admin_digest_received": "📦 Awaiting release ({count}):",
+        "admin_digest_dispute": "⚠️ Disputes ({count}):",
+        "admin_digest_item": "• `{chat_id}` @{buyer_username} → @{seller_username}",
+        "admin_digest_more": "…and {count} more",
+        "admin_digest_empty": "✅ Nothing is waiting for you.",
+        "admin_digest_commands": "`/bulk_confirm all` · `/bulk_release all` · `/bulk_cancel chat_id`",
+        "admin_bulk_result": "✅ {done} updated, {skipped} skipped (already past this stage or not found).",
+        "admin_bulk_usage": "Usage: `/{command} all` or `/{command} chat_id ...`",
+        "admin_cancel_usage": "Usage: `/bulk_cancel chat_id ...`",
+
+        "stats_title": "📈 Bot Stats",
+        "profiler_started": "🔬 Profiler started. Send /profile again to stop it.",
+        "profiler_stopped": "🔬 Profiler stopped. Results written to {path}."
+    }
+}
+
+# Validates every language (same keys and placeholders as Hausa) at startup and
+# precompiles templates and static keyboards; extra languages are read lazily
+# from locales/<CODE>.json the first time a user picks them
+LOCALES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'locales')
+catalog = Catalog(MESSAGES, default_language='HA', locales_dir=LOCALES_DIR)
+
+# --- Application ---
+def build_application(worker=0, workers=1):
+    """Builds the bot's Application with the outbound scheduler, admin queue and metrics.
+
+    In webhook mode each worker process builds its own (see webhook.run); a
+    polling bot is worker 0 of 1.
+    """
+    application = ApplicationBuilder().token(BOT_TOKEN).build()
+
+    async def post_shutdown(app):
+        async_store.close()  # flush writes still waiting for the writer thread
+
+    # Set first so the attachments below stop their work before this runs
+    application.post_shutdown = post_shutdown
+    # The workers share Telegram's bot-wide limit, and one of them posts the digest
+    outbound.attach(application, global_rate=outbound.GLOBAL_RATE / workers)
+    admin_queue.attach(application, async_store, catalog, ADMIN_ID,
+                       enabled=ADMIN_QUEUE_MODE, interval=ADMIN_DIGEST_INTERVAL,
+                       poll=workers > 1, post_digest=worker == 0)
+    # Last, so every handler registered above is instrumented
+    metrics.attach(application, store, async_store, catalog, ADMIN_ID,
+                   port=METRICS_PORT + worker if METRICS_PORT else 0, profile_output=PROFILE_OUTPUT)
+    return application
+
+def main():
+    if WEBHOOK_URL:
+        # Migrations run once here, before any worker starts
+        webhook.run(build_application, BOT_TOKEN, WEBHOOK_URL, workers=WEBHOOK_WORKERS,
+                    port=WEBHOOK_PORT, secret_token=WEBHOOK_SECRET, prepare=init_db)
+    else:
+        init_db()
+        build_application().run_polling()
+
+if __name__ == "__main__":
+    logging.basicConfig(format="%(asctime)s %(name)s %(levelname)s %(message)s", level=logging.INFO)
+    main()
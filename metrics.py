@@ -0,0 +1,404 @@
+import asyncio
+import functools
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter as _Tally
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from telegram.ext import CommandHandler
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds in seconds; SQLite calls land in the low buckets, Telegram calls in the high ones
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs += [f'{name}="{value}"' for name, value in extra]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+
+    def header(self):
+        return [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        super().__init__(name, help, labels)
+        self.values = {}
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def snapshot(self):
+        """Returns a copy of {labels: count} that is safe to iterate from any thread."""
+        with self._lock:
+            return dict(self.values)
+
+    def expose(self):
+        items = sorted(self.snapshot().items())
+        return self.header() + [f'{self.name}{_labels(self.label_names, k)} {v}' for k, v in items]
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+        self.values = {}  # labels -> [per-bucket counts..., +Inf count, sum]
+
+    def observe(self, seconds, *labels):
+        with self._lock:
+            series = self.values.get(labels)
+            if series is None:
+                series = self.values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    series[i] += 1
+                    break
+            else:
+                series[len(self.buckets)] += 1
+            series[-1] += seconds
+
+    def snapshot(self):
+        """Returns a copy of {labels: series} that is safe to iterate from any thread."""
+        with self._lock:
+            return {labels: list(series) for labels, series in self.values.items()}
+
+    def summary(self, *labels):
+        """Returns (count, sum, p50, p99) for one label set, quantiles estimated from buckets."""
+        with self._lock:
+            series = list(self.values.get(labels, ()))
+        if not series:
+            return 0, 0.0, 0.0, 0.0
+        counts, total = series[:-1], series[-1]
+        count = sum(counts)
+        return count, total, self._quantile(counts, count, 0.5), self._quantile(counts, count, 0.99)
+
+    def _quantile(self, counts, count, q):
+        rank = q * count
+        seen = 0
+        lower = 0.0
+        for i, bound in enumerate(self.buckets):
+            if seen + counts[i] >= rank and counts[i]:
+                return lower + (bound - lower) * (rank - seen) / counts[i]
+            seen += counts[i]
+            lower = bound
+        return self.buckets[-1]
+
+    def expose(self):
+        items = sorted(self.snapshot().items())
+        lines = self.header()
+        for labels, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), series[:-1]):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{_labels(self.label_names, labels, [("le", bound)])} {cumulative}')
+            lines.append(f'{self.name}_sum{_labels(self.label_names, labels)} {series[-1]}')
+            lines.append(f'{self.name}_count{_labels(self.label_names, labels)} {cumulative}')
+        return lines
+
+
+class Gauge(_Metric):
+    """A gauge read at scrape time from callback() -> {label tuple: value}."""
+    kind = 'gauge'
+
+    def __init__(self, name, help, labels=(), callback=None):
+        super().__init__(name, help, labels)
+        self.callback = callback
+
+    def collect(self):
+        try:
+            return self.callback() if self.callback else {}
+        except Exception:
+            logger.exception("Gauge %s failed", self.name)
+            return {}
+
+    def expose(self):
+        return self.header() + [f'{self.name}{_labels(self.label_names, k)} {v}'
+                                for k, v in sorted(self.collect().items())]
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+
+    def register(self, metric):
+        # Re-registering a name (e.g. a second attach) replaces the old metric
+        self.metrics[metric.name] = metric
+        return metric
+
+    def expose(self):
+        lines = []
+        for metric in self.metrics.values():
+            lines.extend(metric.expose())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+# --- Built-in Metrics ---
+HANDLER_CALLS = REGISTRY.register(Counter('escrow_handler_calls_total', 'Handler invocations.', ('handler',)))
+HANDLER_ERRORS = REGISTRY.register(Counter('escrow_handler_errors_total', 'Handler invocations that raised.', ('handler',)))
+HANDLER_SECONDS = REGISTRY.register(Histogram('escrow_handler_seconds', 'Handler latency.', ('handler',)))
+DB_CALLS = REGISTRY.register(Counter('escrow_db_calls_total', 'Database helper calls.', ('op',)))
+DB_ERRORS = REGISTRY.register(Counter('escrow_db_errors_total', 'Database helper calls that raised.', ('op',)))
+DB_SECONDS = REGISTRY.register(Histogram('escrow_db_seconds', 'Database helper latency.', ('op',)))
+RENDER_SECONDS = REGISTRY.register(Histogram('escrow_render_seconds', 'Time to render one catalog message.'))
+TELEGRAM_SECONDS = REGISTRY.register(Histogram('escrow_telegram_seconds', 'Bot API call latency.', ('method',)))
+TELEGRAM_ERRORS = REGISTRY.register(Counter('escrow_telegram_errors_total', 'Bot API calls that raised.', ('method', 'error')))
+DB_BATCH_SIZE = REGISTRY.register(Histogram('escrow_db_write_batch_size', 'Writes committed per batched transaction.',
+                                            buckets=(1, 2, 5, 10, 20, 50, 100, 200)))
+
+
+# --- Instrumentation ---
+def instrument_db(fn, op=None):
+    """Wraps a blocking DB helper with call, error and latency metrics."""
+    op = op or fn.__name__
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        return timed_db_call(op, fn, *args, **kwargs)
+    return wrapper
+
+
+def timed_db_call(op, fn, *args, **kwargs):
+    """Calls fn and records the call under `op` in the DB metrics."""
+    started = time.perf_counter()
+    try:
+        return fn(*args, **kwargs)
+    except Exception:
+        DB_ERRORS.inc(op)
+        raise
+    finally:
+        DB_CALLS.inc(op)
+        DB_SECONDS.observe(time.perf_counter() - started, op)
+
+
+def instrument_handler(callback, name=None):
+    """Wraps an async PTB handler callback with call, error and latency metrics."""
+    name = name or getattr(callback, '__name__', type(callback).__name__)
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        started = time.perf_counter()
+        try:
+            return await callback(update, context)
+        except Exception:
+            HANDLER_ERRORS.inc(name)
+            raise
+        finally:
+            HANDLER_CALLS.inc(name)
+            HANDLER_SECONDS.observe(time.perf_counter() - started, name)
+    wrapper.instrumented = True
+    return wrapper
+
+
+def instrument_application(application):
+    """Instruments every handler registered on the application so far."""
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            if asyncio.iscoroutinefunction(handler.callback) and not getattr(handler.callback, 'instrumented', False):
+                handler.callback = instrument_handler(handler.callback)
+
+
+# --- HTTP Endpoint ---
+class _MetricsHandler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = self.registry.expose().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # scrapes every few seconds would flood the bot's log
+
+
+def start_http_server(port, host='127.0.0.1', registry=REGISTRY):
+    """Serves /metrics in Prometheus text format from a daemon thread.
+
+    Scrapes are handled one at a time on that one thread: gauges read the
+    database, and a thread per scrape would leave a SQLite connection behind
+    for every request.
+    """
+    handler = type('MetricsHandler', (_MetricsHandler,), {'registry': registry})
+    server = HTTPServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+    logger.info("Serving metrics on http://%s:%s/metrics", host, port)
+    return server
+
+
+# --- Sampling Profiler ---
+class SamplingProfiler:
+    """Samples every thread's stack at a fixed interval and counts call paths.
+
+    Cheap enough to leave on for a while in production. dump() writes the
+    hottest paths in collapsed-stack format ("a;b;c count"), which
+    flamegraph.pl and speedscope read directly.
+    """
+
+    def __init__(self, output, interval=0.005, max_depth=40):
+        self.output = output
+        self.interval = interval
+        self.max_depth = max_depth
+        self.samples = _Tally()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def start(self):
+        if self._thread is None:
+            self.samples.clear()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Stops sampling and writes the profile; returns the output path."""
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        self.dump()
+        return self.output
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < self.max_depth:
+                    code = frame.f_code
+                    stack.append(f'{os.path.basename(code.co_filename)}:{code.co_name}')
+                    frame = frame.f_back
+                self.samples[';'.join(reversed(stack))] += 1
+
+    def dump(self, top=200):
+        with open(self.output, 'w', encoding='utf-8') as f:
+            for stack, count in self.samples.most_common(top):
+                f.write(f'{stack} {count}\n')
+
+
+# --- Admin Commands ---
+def format_stats(stages=None, caches=None, outbound=None, top=8):
+    """Plain-text summary of the busiest handlers and DB calls, stages and caches.
+
+    stages, caches and outbound are plain values read beforehand: deal counts
+    per stage, Storage.cache_stats() and the scheduler's stats plus 'pending'.
+    """
+    lines = []
+    for title, calls, errors, histogram in (('Handlers', HANDLER_CALLS, HANDLER_ERRORS, HANDLER_SECONDS),
+                                            ('DB', DB_CALLS, DB_ERRORS, DB_SECONDS)):
+        # The handlers and DB threads keep adding label sets, so work on copies
+        busiest = sorted(calls.snapshot().items(), key=lambda item: -item[1])[:top]
+        if not busiest:
+            continue
+        error_counts = errors.snapshot()
+        lines.append(f'{title}: calls  err  p50ms  p99ms')
+        for labels, count in busiest:
+            _, _, p50, p99 = histogram.summary(*labels)
+            lines.append(f'  {labels[0]}: {count} {error_counts.get(labels, 0)} {p50 * 1000:.2f} {p99 * 1000:.2f}')
+    count, total, p50, p99 = RENDER_SECONDS.summary()
+    if count:
+        lines.append(f'Render: {count} msgs, p50 {p50 * 1e6:.0f}µs, p99 {p99 * 1e6:.0f}µs')
+    for labels in sorted(TELEGRAM_SECONDS.snapshot()):
+        count, _, p50, p99 = TELEGRAM_SECONDS.summary(*labels)
+        lines.append(f'Telegram {labels[0]}: {count}, p50 {p50 * 1000:.0f}ms, p99 {p99 * 1000:.0f}ms')
+    if stages:
+        lines.append('Deals: ' + ', '.join(f'{stage}={count}' for stage, count in sorted(stages.items(), key=str)))
+    for name, stats in (caches or {}).items():
+        if stats:
+            lines.append(f"Cache {name}: {stats['hit_ratio']:.0%} hits, {stats['entries']} entries, "
+                         f"{stats['bytes'] // 1024} KB, {stats['evictions']} evictions")
+    if outbound is not None:
+        outbound = dict(outbound)
+        lines.append(f"Outbound: {outbound.pop('pending')} pending, " +
+                     ', '.join(f'{k}={v}' for k, v in outbound.items()))
+    return '\n'.join(lines)
+
+
+def attach(application, store, async_store, catalog, admin_id, port=0, profile_output='profile.txt'):
+    """Adds /stats and /profile for the admin, deal and cache gauges, and the
+    optional /metrics endpoint (port 0 leaves it off). Call after all other
+    handlers are registered so they get instrumented too.
+
+    The gauges read store from the metrics thread; the handlers go through
+    async_store like the rest of the bot.
+    """
+    scheduler = application.bot_data.get('outbound')
+    REGISTRY.register(Gauge('escrow_deals', 'Deals per stage.', ('stage',),
+                            lambda: {(stage,): count for stage, count in store.count_deals_by_stage().items()}))
+    REGISTRY.register(Gauge('escrow_cache_hit_ratio', 'Cache hit ratio.', ('cache',),
+                            lambda: {(name,): stats['hit_ratio'] for name, stats in store.cache_stats().items() if stats}))
+    REGISTRY.register(Gauge('escrow_cache_bytes', 'Approximate cache memory.', ('cache',),
+                            lambda: {(name,): stats['bytes'] for name, stats in store.cache_stats().items() if stats}))
+    if scheduler is not None:
+        REGISTRY.register(Gauge('escrow_outbound_pending', 'Messages waiting to be sent.', (),
+                                lambda: {(): scheduler.pending()}))
+
+    profiler = SamplingProfiler(profile_output)
+
+    async def stats(update, context):
+        message = update.effective_message  # CommandHandler also fires for edited commands
+        language = await async_store.get_user_language(update.effective_user.id)
+        if update.effective_user.id != admin_id:
+            await message.reply_text(catalog.render(language, 'admin_only_command'))
+            return
+        stages = await async_store.count_deals_by_stage()
+        # The scheduler is only touched on the loop, so read it here and hand over copies
+        outbound = dict(scheduler.stats, pending=scheduler.pending()) if scheduler is not None else None
+        text = await asyncio.get_running_loop().run_in_executor(
+            None, format_stats, stages, store.cache_stats(), outbound)
+        await message.reply_text(catalog.render(language, 'stats_title') + '\n' + text)
+
+    async def profile(update, context):
+        message = update.effective_message
+        language = await async_store.get_user_language(update.effective_user.id)
+        if update.effective_user.id != admin_id:
+            await message.reply_text(catalog.render(language, 'admin_only_command'))
+            return
+        if profiler.running:
+            path = await asyncio.get_running_loop().run_in_executor(None, profiler.stop)
+            await message.reply_text(catalog.render(language, 'profiler_stopped', path=path))
+        else:
+            profiler.start()
+            await message.reply_text(catalog.render(language, 'profiler_started'))
+
+    application.add_handlers([CommandHandler('stats', stats), CommandHandler('profile', profile)])
+    instrument_application(application)
+    if port:
+        start_http_server(port)
+    return profiler
@@ -0,0 +1,198 @@
+import logging
+import threading
+import time
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+BACKFILL_BATCH_SIZE = 500  # rows per backfill transaction
+BACKFILL_PAUSE = 0.01      # seconds between batches so handlers can take the write lock
+KEY_START = -2 ** 63       # below every chat_id: where a backfill's keyset walk begins
+
+# apply(conn) runs inside one transaction together with recording the version;
+# it must not depend on an earlier migration's backfill having finished.
+# backfill(conn, after, batch_size) handles the next batch_size rows keyed above
+# `after` and returns (last key, rows updated), or (None, 0) past the last row.
+# Each batch is its own transaction, so it must leave rows that are already
+# done alone: after a restart the walk starts over from KEY_START.
+Migration = namedtuple('Migration', 'version description apply backfill')
+MigrationStep = namedtuple('MigrationStep', 'version description seconds rows_backfilled')
+
+
+class MigrationReport:
+    """What migrate() did and how long it took."""
+
+    def __init__(self):
+        self.steps = []
+        self.seconds = 0.0
+        self.version = 0
+
+    def __str__(self):
+        if not self.steps:
+            return f'schema at version {self.version}, nothing to migrate ({self.seconds * 1000:.1f} ms)'
+        done = ', '.join(
+            f'v{step.version} {step.description} ({step.seconds * 1000:.1f} ms'
+            + (f', {step.rows_backfilled} rows backfilled)' if step.rows_backfilled else ')')
+            for step in self.steps
+        )
+        return f'schema migrated to version {self.version} in {self.seconds * 1000:.1f} ms: {done}'
+
+
+# --- Migration Steps ---
+def _create_base_tables(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS deals (
+            chat_id INTEGER PRIMARY KEY,
+            buyer_id INTEGER,
+            buyer_username TEXT,
+            buyer_address TEXT,
+            seller_id INTEGER,
+            seller_username TEXT,
+            seller_account TEXT,
+            stage TEXT
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS user_languages (
+            user_id INTEGER PRIMARY KEY,
+            language TEXT DEFAULT 'HA'
+        )
+    ''')
+
+
+def _create_deal_indexes(conn):
+    # Per-user status and admin views look deals up by participant or stage
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_deals_buyer_id ON deals (buyer_id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_deals_seller_id ON deals (seller_id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_deals_stage ON deals (stage)')
+
+
+def _add_deal_timestamps(conn):
+    columns = {row[1] for row in conn.execute('PRAGMA table_info(deals)')}
+    for column in ('created_at', 'updated_at'):
+        if column not in columns:
+            conn.execute(f'ALTER TABLE deals ADD COLUMN {column} INTEGER')
+
+
+def _backfill_deal_timestamps(conn, after, batch_size):
+    # Walk the primary key instead of re-searching for NULLs, which would rescan
+    # every row already done on each batch
+    row = conn.execute('SELECT MAX(chat_id) FROM (SELECT chat_id FROM deals WHERE chat_id > ? ORDER BY chat_id LIMIT ?)',
+                       (after, batch_size)).fetchone()
+    if row[0] is None:
+        return None, 0
+    now = int(time.time())
+    rows = conn.execute('''
+        UPDATE deals SET created_at = COALESCE(created_at, ?), updated_at = COALESCE(updated_at, ?)
+        WHERE chat_id > ? AND chat_id <= ? AND (created_at IS NULL OR updated_at IS NULL)
+    ''', (now, now, after, row[0])).rowcount
+    return row[0], rows
+
+
+MIGRATIONS = (
+    Migration(1, 'create deals and user_languages', _create_base_tables, None),
+    Migration(2, 'index deals by buyer, seller and stage', _create_deal_indexes, None),
+    Migration(3, 'add deal created_at/updated_at', _add_deal_timestamps, _backfill_deal_timestamps),
+)
+
+
+# --- Runner ---
+def _ensure_version_table(store):
+    with store.transaction() as conn:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                description TEXT,
+                applied_at INTEGER,
+                completed_at INTEGER
+            )
+        ''')
+
+
+def _run_backfill(store, migration, batch_size, pause):
+    total = 0
+    after = KEY_START
+    while True:
+        with store.transaction() as conn:
+            after, rows = migration.backfill(conn, after, batch_size)
+        total += rows
+        if after is None:
+            break
+        if pause:
+            time.sleep(pause)
+    with store.transaction() as conn:
+        conn.execute('UPDATE schema_version SET completed_at = ? WHERE version = ?',
+                     (int(time.time()), migration.version))
+    return total
+
+
+def migrate(store, migrations=MIGRATIONS, batch_size=BACKFILL_BATCH_SIZE, pause=BACKFILL_PAUSE,
+            backfill=True):
+    """Brings the database schema up to date and returns a MigrationReport.
+
+    Safe to run from several processes at once: each step re-checks its
+    version inside its own write transaction. A step whose backfill was
+    interrupted is recorded with completed_at NULL and its backfill resumes
+    on the next start. With backfill off only the schema changes are made;
+    run_backfills() does the rest later, e.g. once the bot is serving.
+    """
+    report = MigrationReport()
+    started = time.perf_counter()
+    _ensure_version_table(store)
+
+    for migration in sorted(migrations, key=lambda m: m.version):
+        step_started = time.perf_counter()
+        with store.transaction() as conn:
+            row = conn.execute('SELECT completed_at FROM schema_version WHERE version = ?',
+                               (migration.version,)).fetchone()
+            if row is None:
+                migration.apply(conn)
+                completed_at = None if migration.backfill else int(time.time())
+                conn.execute(
+                    'INSERT INTO schema_version (version, description, applied_at, completed_at) VALUES (?, ?, ?, ?)',
+                    (migration.version, migration.description, int(time.time()), completed_at),
+                )
+            elif row[0] is not None:
+                report.version = migration.version
+                continue
+        rows = _run_backfill(store, migration, batch_size, pause) if migration.backfill and backfill else 0
+        report.version = migration.version
+        report.steps.append(MigrationStep(migration.version, migration.description,
+                                          time.perf_counter() - step_started, rows))
+        logger.info('Applied migration %s (%s)', migration.version, migration.description)
+
+    report.seconds = time.perf_counter() - started
+    return report
+
+
+def run_backfills(store, migrations=MIGRATIONS, batch_size=BACKFILL_BATCH_SIZE, pause=BACKFILL_PAUSE):
+    """Finishes every applied migration whose backfill has not completed; returns the rows updated."""
+    pending = {row[0] for row in store.connection().execute(
+        'SELECT version FROM schema_version WHERE completed_at IS NULL')}
+    total = 0
+    for migration in sorted(migrations, key=lambda m: m.version):
+        if migration.version in pending and migration.backfill:
+            started = time.perf_counter()
+            rows = _run_backfill(store, migration, batch_size, pause)
+            total += rows
+            logger.info('Backfilled migration %s (%s): %d rows in %.1f s', migration.version,
+                        migration.description, rows, time.perf_counter() - started)
+    return total
+
+
+def start_backfills(store, migrations=MIGRATIONS, batch_size=BACKFILL_BATCH_SIZE, pause=BACKFILL_PAUSE):
+    """Runs run_backfills() on a daemon thread and returns the thread.
+
+    The bot serves meanwhile: each batch is a short write transaction and the
+    pause between batches lets handlers take the write lock. If the process
+    exits first the backfill is picked up again on the next start.
+    """
+    def run():
+        try:
+            run_backfills(store, migrations, batch_size, pause)
+        except Exception:
+            logger.exception('Backfill failed; it will be retried on the next start')
+
+    thread = threading.Thread(target=run, name='migration-backfill', daemon=True)
+    thread.start()
+    return thread
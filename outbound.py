@@ -0,0 +1,356 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+
+from telegram.error import BadRequest, NetworkError, RetryAfter, TimedOut
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# --- Priorities (lower is sent first) ---
+PRIORITY_ADMIN = 0         # admin alerts: payment claims, disputes, releases
+PRIORITY_CHAT = 1          # replies in the deal's group
+PRIORITY_ANNOUNCEMENT = 2  # deal_complete_announcement to the verification group
+
+# --- Telegram Limits ---
+# Roughly 30 messages/s overall, 1/s in a private chat and 20/min in a group.
+GLOBAL_RATE = 30.0
+GLOBAL_BURST = 30
+PRIVATE_RATE = 1.0
+PRIVATE_BURST = 3
+GROUP_RATE = 20 / 60
+GROUP_BURST = 3
+MAX_IN_FLIGHT = 8  # concurrent API calls
+MAX_ATTEMPTS = 5
+BACKOFF_BASE = 0.5  # seconds, doubled per network failure
+BACKOFF_MAX = 30.0
+SWEEP_INTERVAL = 60.0  # seconds between dropping idle per-chat buckets
+# Calls that are safe to repeat after a TimedOut: Telegram may already have
+# acted on the first one, and a repeated send_message is a duplicate message
+IDEMPOTENT_METHODS = frozenset({'edit_message_text'})
+
+
+class TokenBucket:
+    """Classic token bucket: `rate` tokens per second, holding up to `capacity`."""
+
+    def __init__(self, rate, capacity, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self.tokens = float(capacity)
+        self.updated = clock()
+        self.paused_until = 0.0
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self):
+        """Seconds until a token is available; 0 if one is available now."""
+        now = self.clock()
+        self._refill(now)
+        wait = max(0.0, self.paused_until - now)
+        if self.tokens < 1:
+            wait = max(wait, (1 - self.tokens) / self.rate)
+        return wait
+
+    def consume(self):
+        self._refill(self.clock())
+        self.tokens -= 1
+
+    def full(self):
+        """True when the bucket is indistinguishable from a fresh one."""
+        return self.delay() == 0 and self.tokens >= self.capacity
+
+    def pause(self, seconds):
+        """Blocks the bucket, e.g. for a RetryAfter from Telegram."""
+        self.paused_until = max(self.paused_until, self.clock() + seconds)
+        self.tokens = min(self.tokens, 0.0)
+
+
+class _Outgoing:
+    __slots__ = ('priority', 'seq', 'method', 'kwargs', 'future', 'attempts', 'queued_at')
+
+    def __init__(self, priority, seq, method, kwargs, future, queued_at):
+        self.priority = priority
+        self.seq = seq
+        self.method = method
+        self.kwargs = kwargs
+        self.future = future
+        self.attempts = 0
+        self.queued_at = queued_at
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+def _retry_seconds(error):
+    retry_after = error.retry_after
+    return retry_after.total_seconds() if hasattr(retry_after, 'total_seconds') else float(retry_after)
+
+
+def _backoff(attempts):
+    return min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (attempts - 1))
+
+
+def _consume_exception(future):
+    # Failures are logged in _deliver; don't warn again about unawaited futures
+    if not future.cancelled():
+        future.exception()
+
+
+class OutboundScheduler:
+    """Queues Bot API calls and sends them within Telegram's flood limits.
+
+    Each chat has its own token bucket (private chats and groups have
+    different limits) and messages to one chat keep their order. Across
+    chats the highest priority ready message goes first, under a global
+    bucket. A RetryAfter pauses that chat and the global bucket and the
+    message is retried; network errors back off exponentially. A timed out
+    call is only retried when repeating it cannot duplicate anything.
+    """
+
+    def __init__(self, bot, global_rate=GLOBAL_RATE, global_burst=GLOBAL_BURST,
+                 private_rate=PRIVATE_RATE, private_burst=PRIVATE_BURST,
+                 group_rate=GROUP_RATE, group_burst=GROUP_BURST,
+                 max_in_flight=MAX_IN_FLIGHT, max_attempts=MAX_ATTEMPTS):
+        self.bot = bot
+        self.private_rate = private_rate
+        self.private_burst = private_burst
+        self.group_rate = group_rate
+        self.group_burst = group_burst
+        self.max_in_flight = max_in_flight
+        self.max_attempts = max_attempts
+        self._global = TokenBucket(global_rate, global_burst)
+        self._buckets = {}
+        self._queues = {}       # chat_id -> heap of _Outgoing
+        self._ready = []        # heap of (priority, seq, chat_id) for chats that may send now
+        self._ready_seq = {}    # chat_id -> seq of its live entry in _ready
+        self._timers = []       # heap of (when, chat_id) for throttled chats
+        self._timed = set()     # chats with an entry in _timers
+        self._busy = set()      # chats with a call in flight
+        self._seq = itertools.count()
+        self._wakeup = None
+        self._slots = None
+        self._task = None
+        self._next_sweep = 0.0
+        self._pending = 0       # queued or in flight; a plain int other threads may read
+        self.stats = {'queued': 0, 'sent': 0, 'failed': 0, 'retry_after': 0, 'retries': 0}
+
+    # --- Public API ---
+    def submit(self, method, chat_id, priority=PRIORITY_CHAT, **kwargs):
+        """Queues bot.<method>(chat_id=..., **kwargs) and returns a future for its result.
+
+        Callers may await the future or ignore it; failures are logged either way.
+        """
+        self._ensure_started()
+        future = asyncio.get_running_loop().create_future()
+        future.add_done_callback(_consume_exception)
+        item = _Outgoing(priority, next(self._seq), method, dict(kwargs, chat_id=chat_id),
+                         future, time.monotonic())
+        heapq.heappush(self._queues.setdefault(chat_id, []), item)
+        self.stats['queued'] += 1
+        self._pending += 1
+        self._schedule(chat_id)
+        return future
+
+    def send_message(self, chat_id, text, priority=PRIORITY_CHAT, **kwargs):
+        return self.submit('send_message', chat_id, priority, text=text, **kwargs)
+
+    def edit_message_text(self, chat_id, message_id, text, priority=PRIORITY_CHAT, **kwargs):
+        return self.submit('edit_message_text', chat_id, priority, message_id=message_id, text=text, **kwargs)
+
+    def pending(self):
+        """Calls queued or in flight. Safe to read from another thread, e.g. a metrics scrape."""
+        return self._pending
+
+    async def join(self):
+        """Waits until everything queued so far has been sent or has failed."""
+        while self.pending():
+            await asyncio.sleep(0.01)
+
+    async def stop(self, drain=True):
+        """Stops the scheduler, by default after flushing the queue."""
+        if self._task is None:
+            return
+        if drain:
+            await self.join()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    # --- Scheduling ---
+    def _ensure_started(self):
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._slots = asyncio.Semaphore(self.max_in_flight)
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def _bucket(self, chat_id):
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            if chat_id < 0:
+                bucket = TokenBucket(self.group_rate, self.group_burst)
+            else:
+                bucket = TokenBucket(self.private_rate, self.private_burst)
+            self._buckets[chat_id] = bucket
+        return bucket
+
+    def _schedule(self, chat_id):
+        queue = self._queues.get(chat_id)
+        if not queue:
+            self._queues.pop(chat_id, None)
+            return
+        if chat_id in self._busy:
+            return
+        delay = self._bucket(chat_id).delay()
+        if delay > 0:
+            if chat_id not in self._timed:
+                self._timed.add(chat_id)
+                heapq.heappush(self._timers, (time.monotonic() + delay, chat_id))
+        else:
+            head = queue[0]
+            heapq.heappush(self._ready, (head.priority, head.seq, chat_id))
+            self._ready_seq[chat_id] = head.seq
+        self._wakeup.set()
+
+    def _next_ready(self):
+        while self._ready:
+            _, seq, chat_id = heapq.heappop(self._ready)
+            if self._ready_seq.get(chat_id) != seq or chat_id in self._busy:
+                continue  # superseded by a newer entry for the same chat
+            del self._ready_seq[chat_id]
+            queue = self._queues.get(chat_id)
+            if queue and queue[0].seq == seq:
+                return chat_id
+        return None
+
+    def _sweep(self):
+        # A full bucket is the same as a new one, so idle chats need not keep theirs
+        for chat_id in [chat_id for chat_id, bucket in self._buckets.items()
+                        if chat_id not in self._queues and chat_id not in self._busy and bucket.full()]:
+            del self._buckets[chat_id]
+
+    async def _run(self):
+        while True:
+            now = time.monotonic()
+            if now >= self._next_sweep:
+                self._sweep()
+                self._next_sweep = now + SWEEP_INTERVAL
+            while self._timers and self._timers[0][0] <= now:
+                _, chat_id = heapq.heappop(self._timers)
+                self._timed.discard(chat_id)
+                if chat_id not in self._ready_seq:
+                    self._schedule(chat_id)
+            if not self._ready:
+                timeout = self._timers[0][0] - now if self._timers else None
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            delay = self._global.delay()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            await self._slots.acquire()
+            chat_id = None if self._global.delay() > 0 else self._next_ready()
+            if chat_id is None:
+                # Nothing ready, or the call that freed the slot hit a RetryAfter
+                self._slots.release()
+                continue
+            item = heapq.heappop(self._queues[chat_id])
+            self._global.consume()
+            self._bucket(chat_id).consume()
+            self._busy.add(chat_id)
+            asyncio.get_running_loop().create_task(self._deliver(chat_id, item))
+
+    async def _deliver(self, chat_id, item):
+        item.attempts += 1
+        started = time.perf_counter()
+        try:
+            try:
+                result = await getattr(self.bot, item.method)(**item.kwargs)
+            except Exception as error:
+                metrics.TELEGRAM_ERRORS.inc(item.method, type(error).__name__)
+                raise
+            finally:
+                metrics.TELEGRAM_SECONDS.observe(time.perf_counter() - started, item.method)
+        except RetryAfter as error:
+            self.stats['retry_after'] += 1
+            delay = _retry_seconds(error)
+            # Each chat is already kept under its own limit, so a 429 most likely
+            # means the bot-wide one: hold every chat, not just this one
+            self._global.pause(delay)
+            self._retry(chat_id, item, error, delay)
+        except BadRequest as error:
+            self._fail(item, error)
+        except TimedOut as error:
+            if item.method not in IDEMPOTENT_METHODS:
+                self._fail(item, error)
+            else:
+                self._retry(chat_id, item, error, _backoff(item.attempts))
+        except NetworkError as error:
+            self._retry(chat_id, item, error, _backoff(item.attempts))
+        except Exception as error:
+            self._fail(item, error)
+        else:
+            self.stats['sent'] += 1
+            self._pending -= 1
+            if not item.future.done():
+                item.future.set_result(result)
+        finally:
+            self._busy.discard(chat_id)
+            self._slots.release()
+            self._schedule(chat_id)
+
+    def _retry(self, chat_id, item, error, delay):
+        if item.attempts >= self.max_attempts:
+            self._fail(item, error)
+            return
+        self.stats['retries'] += 1
+        self._bucket(chat_id).pause(delay)
+        # Same seq, so it goes back to the head of its chat's queue
+        heapq.heappush(self._queues.setdefault(chat_id, []), item)
+
+    def _fail(self, item, error):
+        self.stats['failed'] += 1
+        self._pending -= 1
+        logger.warning("Giving up on %s to %s after %d attempt(s): %s",
+                       item.method, item.kwargs.get('chat_id'), item.attempts, error)
+        if not item.future.done():
+            item.future.set_exception(error)
+
+
+def attach(application, **options):
+    """Creates a scheduler for application.bot and stops it with the application.
+
+    The queue is flushed in post_stop, while the bot can still make requests
+    (Application.shutdown() closes its HTTP client before post_shutdown runs).
+    The scheduler is kept in application.bot_data['outbound'].
+    """
+    scheduler = OutboundScheduler(application.bot, **options)
+    application.bot_data['outbound'] = scheduler
+    previous_stop, previous_shutdown = application.post_stop, application.post_shutdown
+
+    async def post_stop(app):
+        await scheduler.stop()
+        if previous_stop is not None:
+            await previous_stop(app)
+
+    async def post_shutdown(app):
+        # Only matters if post_stop never ran, e.g. initialize() failed
+        await scheduler.stop(drain=False)
+        if previous_shutdown is not None:
+            await previous_shutdown(app)
+
+    application.post_stop = post_stop
+    application.post_shutdown = post_shutdown
+    return scheduler
@@ -0,0 +1,130 @@
+from collections import namedtuple
+
+# --- Deal Stages ---
+AWAITING_SELLER = 'awaiting_seller'    # buyer gave an address, seller not in yet
+AWAITING_PAYMENT = 'awaiting_payment'  # seller details in, buyer to pay escrow
+PAYMENT_SENT = 'payment_sent'          # buyer says funds are sent, admin to check
+FUNDS_CONFIRMED = 'funds_confirmed'    # admin saw the funds, seller to deliver
+DELIVERED = 'delivered'                # seller says delivered, buyer to confirm
+RECEIVED = 'received'                  # buyer confirmed, admin to release
+RELEASED = 'released'                  # admin released, seller to confirm
+COMPLETE = 'complete'
+DISPUTE = 'dispute'
+CANCELLED = None  # cancelling removes the deal row
+
+STAGES = (AWAITING_SELLER, AWAITING_PAYMENT, PAYMENT_SENT, FUNDS_CONFIRMED,
+          DELIVERED, RECEIVED, RELEASED, COMPLETE, DISPUTE)
+OPEN_STAGES = tuple(stage for stage in STAGES if stage != COMPLETE)
+
+Transition = namedtuple('Transition', 'sources target')
+
+# Event names match the callback_data of the buttons in catalog.KEYBOARDS
+TRANSITIONS = {
+    'seller_joined': Transition((AWAITING_SELLER,), AWAITING_PAYMENT),
+    'buyer_paid': Transition((AWAITING_PAYMENT,), PAYMENT_SENT),
+    'buyer_not_paid': Transition((AWAITING_PAYMENT,), CANCELLED),
+    'admin_confirm': Transition((PAYMENT_SENT,), FUNDS_CONFIRMED),
+    'seller_delivered': Transition((FUNDS_CONFIRMED,), DELIVERED),
+    'seller_not_delivered': Transition((FUNDS_CONFIRMED,), DISPUTE),
+    'buyer_received': Transition((DELIVERED,), RECEIVED),
+    'buyer_not_received': Transition((DELIVERED,), DISPUTE),
+    'admin_release': Transition((RECEIVED, DISPUTE), RELEASED),
+    'seller_final_received': Transition((RELEASED,), COMPLETE),
+    'seller_final_not_received': Transition((RELEASED,), DISPUTE),
+    'admin_cancel': Transition(OPEN_STAGES, CANCELLED),
+}
+
+
+class StateMachineError(ValueError):
+    """Raised for an event name that is not in TRANSITIONS."""
+
+
+class TransitionResult(namedtuple('TransitionResult', 'ok deal')):
+    """Outcome of fire(): ok with the deal as written, or a conflict.
+
+    On a conflict deal is None: the deal is missing or another tap already
+    moved it on, so the handler can answer "no_deal_or_stage_mismatch" without
+    reading it again. For a cancellation, deal is the row that was removed.
+    """
+
+    @property
+    def conflict(self):
+        return not self.ok
+
+
+def _transition(event):
+    try:
+        return TRANSITIONS[event]
+    except KeyError:
+        raise StateMachineError(f'unknown deal event: {event}') from None
+
+
+def allowed_events(stage):
+    """Returns the events that can fire from a stage."""
+    return [event for event, transition in TRANSITIONS.items() if stage in transition.sources]
+
+
+def open_deal(store, deal_data):
+    """Starts a deal in AWAITING_SELLER unless the chat already has an open one.
+
+    A COMPLETE deal is replaced, so the same group can trade again.
+    """
+    deal = store.create_deal(dict(deal_data, stage=AWAITING_SELLER), replace_stages=(COMPLETE,))
+    return TransitionResult(deal is not None, deal)
+
+
+def fire(store, chat_id, event, **updates):
+    """Applies an event to a deal as one conditional write; see TransitionResult."""
+    transition = _transition(event)
+    if transition.target is CANCELLED:
+        deal = store.delete_deal_if_stage(chat_id, transition.sources)
+    else:
+        deal = store.compare_and_set_stage(chat_id, transition.sources, transition.target, updates)
+    return TransitionResult(deal is not None, deal)
+
+
+def _sources(transition, event, sources):
+    if sources is None:
+        return transition.sources
+    if not set(sources) <= set(transition.sources):
+        raise StateMachineError(f'{event} cannot fire from {", ".join(sorted(set(sources) - set(transition.sources)))}')
+    return tuple(sources)
+
+
+def fire_many(store, chat_ids, event, sources=None):
+    """Applies an event to many deals in one transaction; chat_ids=None means all.
+
+    sources narrows the stages the event fires from, e.g. releasing "all"
+    deals awaiting release without touching disputes. Returns the deals that
+    moved (or were removed, for a cancellation).
+    """
+    transition = _transition(event)
+    stages = _sources(transition, event, sources)
+    if transition.target is CANCELLED:
+        return store.delete_deals_if_stage(chat_ids, stages)
+    return store.compare_and_set_stages(chat_ids, stages, transition.target)
+
+
+async def open_deal_async(async_store, deal_data):
+    """open_deal() through AsyncStorage."""
+    deal = await async_store.create_deal(dict(deal_data, stage=AWAITING_SELLER), (COMPLETE,))
+    return TransitionResult(deal is not None, deal)
+
+
+async def fire_async(async_store, chat_id, event, **updates):
+    """fire() through AsyncStorage."""
+    transition = _transition(event)
+    if transition.target is CANCELLED:
+        deal = await async_store.delete_deal_if_stage(chat_id, transition.sources)
+    else:
+        deal = await async_store.compare_and_set_stage(chat_id, transition.sources, transition.target, updates)
+    return TransitionResult(deal is not None, deal)
+
+
+async def fire_many_async(async_store, chat_ids, event, sources=None):
+    """fire_many() through AsyncStorage."""
+    transition = _transition(event)
+    stages = _sources(transition, event, sources)
+    if transition.target is CANCELLED:
+        return await async_store.delete_deals_if_stage(chat_ids, stages)
+    return await async_store.compare_and_set_stages(chat_ids, stages, transition.target)
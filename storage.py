@@ -0,0 +1,381 @@
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from cache import MISSING, LRUCache
+from migrations import migrate
+
+# --- Connection Settings ---
+# WAL lets readers keep going while a handler holds the write lock, and with
+# synchronous=NORMAL a commit no longer waits on an fsync (only checkpoints do).
+DEFAULT_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,      # ms to wait for a lock instead of failing at once
+    'temp_store': 'MEMORY',
+    'cache_size': -2000,       # ~2 MB page cache per connection
+}
+CACHED_STATEMENTS = 64  # prepared statements kept per connection
+
+# --- Cache Settings ---
+CACHE_MAX_BYTES = 1024 * 1024  # shared by both caches; 0 turns caching off
+CACHE_MAX_ENTRIES = 10000
+CACHE_TTL = 300  # seconds
+
+PAGE_SIZE = 500  # rows per query when streaming deals
+BULK_CHUNK = 500  # chat_ids per statement in bulk writes, well under SQLite's variable limit
+# Columns a stage transition may fill in alongside the new stage
+DEAL_FIELDS = ('buyer_id', 'buyer_username', 'buyer_address', 'seller_id', 'seller_username', 'seller_account')
+
+
+class Storage:
+    """Long-lived SQLite connections for the deal store, one per thread."""
+
+    def __init__(self, db_name, pragmas=None, cached_statements=CACHED_STATEMENTS,
+                 cache_max_bytes=CACHE_MAX_BYTES, cache_max_entries=CACHE_MAX_ENTRIES, cache_ttl=CACHE_TTL):
+        self.db_name = db_name
+        self.pragmas = dict(DEFAULT_PRAGMAS, **(pragmas or {}))
+        self.cached_statements = cached_statements
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+        self.deal_cache = None
+        self.language_cache = None
+        if cache_max_bytes > 0:
+            # Deal rows are much bigger than language codes, so they get most of the budget
+            self.deal_cache = LRUCache(cache_max_entries, cache_max_bytes * 3 // 4, cache_ttl)
+            self.language_cache = LRUCache(cache_max_entries, cache_max_bytes // 4, cache_ttl)
+
+    # --- Connection Management ---
+    def connection(self):
+        """Returns this thread's connection, opening it on first use."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._connect()
+            self._local.conn = conn
+            self._local.depth = 0
+            self._local.on_commit = []
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def _connect(self):
+        # isolation_level=None: transactions are opened explicitly in transaction()
+        conn = sqlite3.connect(
+            self.db_name,
+            isolation_level=None,
+            check_same_thread=False,
+            cached_statements=self.cached_statements,
+        )
+        conn.row_factory = sqlite3.Row
+        for name, value in self.pragmas.items():
+            conn.execute(f'PRAGMA {name} = {value}')
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        """Runs the block in one write transaction; nested blocks join the outer one."""
+        conn = self.connection()
+        if self._local.depth:
+            self._local.depth += 1
+            try:
+                yield conn
+            finally:
+                self._local.depth -= 1
+            return
+        conn.execute('BEGIN IMMEDIATE')
+        self._local.depth = 1
+        try:
+            yield conn
+        except BaseException:
+            self._local.depth = 0
+            self._local.on_commit = []
+            conn.execute('ROLLBACK')
+            raise
+        self._local.depth = 0
+        callbacks, self._local.on_commit = self._local.on_commit, []
+        conn.execute('COMMIT')
+        for callback in callbacks:
+            callback()
+
+    def _after_commit(self, callback):
+        # Caches only ever see committed data; a rolled back write leaves them alone
+        if self._local.depth:
+            self._local.on_commit.append(callback)
+        else:
+            callback()
+
+    def _in_transaction(self):
+        return bool(getattr(self._local, 'depth', 0))
+
+    def close(self):
+        """Closes every connection opened by this store."""
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            conn.close()
+        self._local = threading.local()
+
+    def cache_stats(self):
+        """Returns hit/miss/eviction counters for each cache."""
+        return {
+            'deals': self.deal_cache.stats() if self.deal_cache else None,
+            'languages': self.language_cache.stats() if self.language_cache else None,
+        }
+
+    def init_schema(self, backfill=True):
+        """Runs pending schema migrations and returns the MigrationReport.
+
+        With backfill off, data backfills are left for migrations.run_backfills().
+        """
+        return migrate(self, backfill=backfill)
+
+    # --- Deals ---
+    def save_deal(self, deal_data):
+        """Saves or updates a deal."""
+        with self.transaction() as conn:
+            now = int(time.time())
+            # Upsert rather than INSERT OR REPLACE so created_at survives updates
+            rows = conn.execute('''
+                INSERT INTO deals (chat_id, buyer_id, buyer_username, buyer_address, seller_id, seller_username, seller_account, stage, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (chat_id) DO UPDATE SET
+                    buyer_id = excluded.buyer_id, buyer_username = excluded.buyer_username,
+                    buyer_address = excluded.buyer_address, seller_id = excluded.seller_id,
+                    seller_username = excluded.seller_username, seller_account = excluded.seller_account,
+                    stage = excluded.stage, updated_at = excluded.updated_at
+                RETURNING *
+            ''', (
+                deal_data['chat_id'], deal_data['buyer_id'], deal_data['buyer_username'], deal_data['buyer_address'],
+                deal_data.get('seller_id'), deal_data.get('seller_username'), deal_data.get('seller_account'), deal_data['stage'],
+                now, now
+            )).fetchall()
+            self._cache_deal(rows[0])
+
+    def get_deal(self, chat_id):
+        """Retrieves a deal, or None."""
+        deal = self.cached_deal(chat_id)
+        if deal is MISSING:
+            return self.load_deal(chat_id)
+        return deal
+
+    def cached_deal(self, chat_id):
+        """Returns the deal from the cache (None if known absent), or MISSING."""
+        if not self.deal_cache or self._in_transaction():
+            return MISSING
+        deal = self.deal_cache.get(chat_id)
+        # Callers edit the dict before saving it; never hand out the cached object
+        return deal if deal is MISSING or deal is None else dict(deal)
+
+    def load_deal(self, chat_id):
+        """Reads a deal from the database and fills the cache."""
+        row = self.connection().execute('SELECT * FROM deals WHERE chat_id = ?', (chat_id,)).fetchone()
+        deal = dict(row) if row else None
+        if self.deal_cache and not self._in_transaction():
+            self.deal_cache.add(chat_id, deal)
+        return dict(deal) if deal else None
+
+    def delete_deal(self, chat_id):
+        """Deletes a deal."""
+        with self.transaction() as conn:
+            conn.execute('DELETE FROM deals WHERE chat_id = ?', (chat_id,))
+            self._forget_deal(chat_id)
+
+    def _cache_deal(self, row):
+        if self.deal_cache:
+            deal = dict(row)
+            self._after_commit(lambda: self.deal_cache.set(deal['chat_id'], deal))
+
+    def _forget_deal(self, chat_id):
+        if self.deal_cache:
+            # Remember the absence so a racing read cannot re-add the old row
+            self._after_commit(lambda: self.deal_cache.set(chat_id, None))
+
+    # --- Conditional Writes ---
+    def create_deal(self, deal_data, replace_stages=()):
+        """Inserts a new deal unless the chat already has one.
+
+        A deal whose stage is in replace_stages (e.g. a finished one) may be
+        overwritten. Returns the new deal, or None if the chat was taken.
+        """
+        now = int(time.time())
+        stages = tuple(replace_stages)
+        conflict = 'NOTHING'
+        if stages:
+            conflict = f'''UPDATE SET
+                buyer_id = excluded.buyer_id, buyer_username = excluded.buyer_username,
+                buyer_address = excluded.buyer_address, seller_id = excluded.seller_id,
+                seller_username = excluded.seller_username, seller_account = excluded.seller_account,
+                stage = excluded.stage, created_at = excluded.created_at, updated_at = excluded.updated_at
+                WHERE deals.stage IN ({', '.join('?' * len(stages))})'''
+        with self.transaction() as conn:
+            rows = conn.execute(f'''
+                INSERT INTO deals (chat_id, buyer_id, buyer_username, buyer_address, seller_id, seller_username, seller_account, stage, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (chat_id) DO {conflict}
+                RETURNING *
+            ''', (
+                deal_data['chat_id'], deal_data['buyer_id'], deal_data['buyer_username'], deal_data['buyer_address'],
+                deal_data.get('seller_id'), deal_data.get('seller_username'), deal_data.get('seller_account'), deal_data['stage'],
+                now, now, *stages
+            )).fetchall()
+            if not rows:
+                return None
+            self._cache_deal(rows[0])
+            return dict(rows[0])
+
+    def compare_and_set_stage(self, chat_id, from_stages, to_stage, updates=None):
+        """Moves a deal to to_stage only if its stage is one of from_stages.
+
+        One conditional UPDATE, so concurrent taps cannot both win. Returns the
+        updated deal, or None when the deal is missing or already elsewhere.
+        """
+        updates = updates or {}
+        unknown = set(updates) - set(DEAL_FIELDS)
+        if unknown:
+            raise ValueError(f"cannot update deal columns: {', '.join(sorted(unknown))}")
+        stages = tuple(from_stages)
+        assignments = ''.join(f', {column} = ?' for column in updates)
+        with self.transaction() as conn:
+            rows = conn.execute(f'''
+                UPDATE deals SET stage = ?, updated_at = ?{assignments}
+                WHERE chat_id = ? AND stage IN ({', '.join('?' * len(stages))})
+                RETURNING *
+            ''', (to_stage, int(time.time()), *updates.values(), chat_id, *stages)).fetchall()
+            if not rows:
+                return None
+            self._cache_deal(rows[0])
+            return dict(rows[0])
+
+    def delete_deal_if_stage(self, chat_id, from_stages):
+        """Deletes a deal only if its stage is one of from_stages; returns it or None."""
+        stages = tuple(from_stages)
+        with self.transaction() as conn:
+            rows = conn.execute(f'''
+                DELETE FROM deals WHERE chat_id = ? AND stage IN ({', '.join('?' * len(stages))})
+                RETURNING *
+            ''', (chat_id, *stages)).fetchall()
+            if not rows:
+                return None
+            self._forget_deal(chat_id)
+            return dict(rows[0])
+
+    def compare_and_set_stages(self, chat_ids, from_stages, to_stage):
+        """Bulk compare_and_set_stage in one transaction.
+
+        chat_ids=None moves every deal in from_stages. Returns the deals that
+        moved; the others were missing or already elsewhere.
+        """
+        return self._bulk_write(
+            'UPDATE deals SET stage = ?, updated_at = ?', (to_stage, int(time.time())),
+            chat_ids, from_stages, self._cache_deal,
+        )
+
+    def delete_deals_if_stage(self, chat_ids, from_stages):
+        """Bulk delete_deal_if_stage in one transaction; returns the removed deals."""
+        return self._bulk_write(
+            'DELETE FROM deals', (), chat_ids, from_stages,
+            lambda row: self._forget_deal(row['chat_id']),
+        )
+
+    def _bulk_write(self, statement, params, chat_ids, from_stages, on_row):
+        stages = tuple(from_stages)
+        where = f" WHERE stage IN ({', '.join('?' * len(stages))})"
+        if chat_ids is None:
+            chunks = [()]
+        else:
+            chat_ids = list(chat_ids)
+            chunks = [chat_ids[i:i + BULK_CHUNK] for i in range(0, len(chat_ids), BULK_CHUNK)]
+        deals = []
+        with self.transaction() as conn:
+            for chunk in chunks:
+                sql = statement + where
+                if chat_ids is not None:
+                    sql += f" AND chat_id IN ({', '.join('?' * len(chunk))})"
+                for row in conn.execute(sql + ' RETURNING *', (*params, *stages, *chunk)).fetchall():
+                    on_row(row)
+                    deals.append(dict(row))
+        return deals
+
+    def get_all_deals(self):
+        """Retrieves all deals keyed by chat_id. Prefer iter_deals() for listings."""
+        return {deal['chat_id']: deal for deal in self.iter_deals()}
+
+    def get_deals_for_user(self, user_id):
+        """Retrieves the deals where the user is buyer or seller."""
+        # Two indexed lookups instead of an OR, which would scan the table
+        rows = self.connection().execute('''
+            SELECT * FROM deals WHERE buyer_id = ?
+            UNION
+            SELECT * FROM deals WHERE seller_id = ?
+            ORDER BY chat_id
+        ''', (user_id, user_id))
+        return [dict(row) for row in rows]
+
+    def get_deals_in_stage(self, stage, limit=None):
+        """Retrieves the deals currently in the given stage."""
+        rows = self.connection().execute(
+            'SELECT * FROM deals WHERE stage = ? ORDER BY chat_id LIMIT ?',
+            (stage, -1 if limit is None else limit),
+        )
+        return [dict(row) for row in rows]
+
+    def get_deals_page(self, after_chat_id=None, limit=50, stage=None):
+        """Retrieves up to `limit` deals with chat_id above `after_chat_id`.
+
+        Keyset pagination: pass the last chat_id of a page to get the next one,
+        so every page costs an index seek however deep the listing goes.
+        """
+        query = 'SELECT * FROM deals WHERE chat_id > ?'
+        params = [-2**63 if after_chat_id is None else after_chat_id]
+        if stage is not None:
+            query += ' AND stage = ?'
+            params.append(stage)
+        query += ' ORDER BY chat_id LIMIT ?'
+        params.append(limit)
+        return [dict(row) for row in self.connection().execute(query, params)]
+
+    def count_deals_by_stage(self):
+        """Returns {stage: number of deals}, counted from the stage index."""
+        rows = self.connection().execute('SELECT stage, COUNT(*) FROM deals GROUP BY stage')
+        return {stage: count for stage, count in rows}
+
+    def iter_deals(self, stage=None, page_size=PAGE_SIZE):
+        """Yields every deal page by page, keeping memory flat on large tables."""
+        after_chat_id = None
+        while True:
+            page = self.get_deals_page(after_chat_id, page_size, stage)
+            yield from page
+            if len(page) < page_size:
+                return
+            after_chat_id = page[-1]['chat_id']
+
+    # --- User Languages ---
+    def save_user_language(self, user_id, language):
+        """Saves or updates a user's language preference."""
+        with self.transaction() as conn:
+            conn.execute('INSERT OR REPLACE INTO user_languages (user_id, language) VALUES (?, ?)', (user_id, language))
+            if self.language_cache:
+                self._after_commit(lambda: self.language_cache.set(user_id, language))
+
+    def get_user_language(self, user_id):
+        """Retrieves a user's language preference, defaulting to Hausa."""
+        language = self.cached_user_language(user_id)
+        if language is MISSING:
+            return self.load_user_language(user_id)
+        return language
+
+    def cached_user_language(self, user_id):
+        """Returns the language from the cache, or MISSING."""
+        if not self.language_cache or self._in_transaction():
+            return MISSING
+        return self.language_cache.get(user_id)
+
+    def load_user_language(self, user_id):
+        """Reads a language preference from the database and fills the cache."""
+        row = self.connection().execute('SELECT language FROM user_languages WHERE user_id = ?', (user_id,)).fetchone()
+        language = row[0] if row else 'HA' # Default to Hausa if not found
+        if self.language_cache and not self._in_transaction():
+            self.language_cache.add(user_id, language)
+        return language
@@ -0,0 +1,29 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import state_machine  # noqa: E402
+from storage import Storage  # noqa: E402
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = Storage(str(tmp_path / 'escrow.db'))
+    store.init_schema()
+    yield store
+    store.close()
+
+
+@pytest.fixture
+def make_deal(store):
+    """Saves a deal in the given stage and returns it as stored."""
+    def make(chat_id=-100, stage=state_machine.AWAITING_PAYMENT, **fields):
+        store.save_deal(dict({
+            'chat_id': chat_id, 'buyer_id': 1, 'buyer_username': 'buyer', 'buyer_address': 'TRjq',
+            'seller_id': 2, 'seller_username': 'seller', 'seller_account': 'Opay 913',
+        }, stage=stage, **fields))
+        return store.load_deal(chat_id)
+    return make
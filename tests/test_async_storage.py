@@ -0,0 +1,36 @@
+import asyncio
+
+import state_machine
+from async_storage import AsyncStorage
+
+
+def test_failed_batch_only_caches_committed_writes(store, make_deal):
+    make_deal(-1, state_machine.AWAITING_PAYMENT)
+    make_deal(-2, state_machine.AWAITING_PAYMENT)
+    for chat_id in (-1, -2):
+        store.get_deal(chat_id)  # warm the cache
+
+    def fails_after_writing():
+        store.compare_and_set_stage(-2, (state_machine.AWAITING_PAYMENT,), state_machine.PAYMENT_SENT)
+        raise RuntimeError('bad write')
+
+    async def run():
+        # A wide window so both writes land in the same batch
+        async_store = AsyncStorage(store, batch_window=0.2)
+        try:
+            return await asyncio.gather(
+                async_store.compare_and_set_stage(-1, (state_machine.AWAITING_PAYMENT,), state_machine.PAYMENT_SENT),
+                async_store.write(fails_after_writing),
+                return_exceptions=True,
+            )
+        finally:
+            async_store.close()
+
+    good, bad = asyncio.run(run())
+    assert good['stage'] == state_machine.PAYMENT_SENT
+    assert isinstance(bad, RuntimeError)
+    # The good write was retried on its own and committed; the bad one never was
+    assert store.cached_deal(-1) == store.load_deal(-1)
+    assert store.cached_deal(-1)['stage'] == state_machine.PAYMENT_SENT
+    assert store.cached_deal(-2)['stage'] == state_machine.AWAITING_PAYMENT
+    assert store.load_deal(-2)['stage'] == state_machine.AWAITING_PAYMENT
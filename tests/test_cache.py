@@ -0,0 +1,38 @@
+import pytest
+
+import state_machine
+
+
+def test_rolled_back_transaction_leaves_cache_alone(store, make_deal):
+    make_deal(-100, state_machine.AWAITING_PAYMENT)
+    assert store.get_deal(-100)['stage'] == state_machine.AWAITING_PAYMENT  # now cached
+    with pytest.raises(RuntimeError):
+        with store.transaction():
+            assert store.compare_and_set_stage(-100, (state_machine.AWAITING_PAYMENT,), state_machine.PAYMENT_SENT)
+            raise RuntimeError('handler failed')
+    assert store.cached_deal(-100)['stage'] == state_machine.AWAITING_PAYMENT
+    assert store.load_deal(-100)['stage'] == state_machine.AWAITING_PAYMENT
+
+
+def test_rolled_back_delete_leaves_cache_alone(store, make_deal):
+    before = make_deal(-100, state_machine.AWAITING_PAYMENT)
+    store.get_deal(-100)
+    with pytest.raises(RuntimeError):
+        with store.transaction():
+            store.delete_deal_if_stage(-100, (state_machine.AWAITING_PAYMENT,))
+            raise RuntimeError('handler failed')
+    assert store.cached_deal(-100) == before
+
+
+def test_bulk_write_rolled_back_leaves_cache_alone(store, make_deal):
+    for chat_id in (-1, -2):
+        make_deal(chat_id, state_machine.PAYMENT_SENT)
+        store.get_deal(chat_id)
+    with pytest.raises(RuntimeError):
+        with store.transaction():
+            assert len(store.compare_and_set_stages([-1, -2], (state_machine.PAYMENT_SENT,),
+                                                    state_machine.FUNDS_CONFIRMED)) == 2
+            raise RuntimeError('handler failed')
+    for chat_id in (-1, -2):
+        assert store.cached_deal(chat_id)['stage'] == state_machine.PAYMENT_SENT
+        assert store.load_deal(chat_id)['stage'] == state_machine.PAYMENT_SENT
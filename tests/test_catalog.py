@@ -0,0 +1,58 @@
+import json
+
+import pytest
+
+from catalog import Catalog, CatalogError, language_code
+
+MESSAGES = {
+    'HA': {'greeting': 'Sannu {name}'},
+    'EN': {'greeting': 'Hello {name}'},
+}
+
+
+@pytest.fixture
+def locales(tmp_path):
+    (tmp_path / 'FR.json').write_text(json.dumps({'greeting': 'Bonjour {name}'}), encoding='utf-8')
+    (tmp_path / 'DE.json').write_text(json.dumps({'greeting': 'Hallo {who}'}), encoding='utf-8')
+    (tmp_path / 'ES.json').write_text('{"greeting": ', encoding='utf-8')
+    (tmp_path / 'secret.json').write_text(json.dumps({'greeting': 'leaked {name}'}), encoding='utf-8')
+    return tmp_path
+
+
+@pytest.fixture
+def catalog(locales):
+    (locales / 'locales').mkdir()
+    return Catalog(MESSAGES, keyboards={}, locales_dir=str(locales / 'locales'))
+
+
+def test_language_code_validation():
+    assert language_code('en') == 'EN'
+    assert language_code('HA') == 'HA'
+    for bad in ('../secret', 'e n', 'EN1', '', 'ABCDEFGHI', 'ÉN', None):
+        assert language_code(bad) is None
+
+
+def test_built_in_language_mismatch_fails_at_startup():
+    with pytest.raises(CatalogError, match='placeholders'):
+        Catalog({'HA': {'greeting': 'Sannu {name}'}, 'EN': {'greeting': 'Hello'}}, keyboards={})
+
+
+def test_locale_file_is_loaded(locales):
+    catalog = Catalog(MESSAGES, keyboards={}, locales_dir=str(locales))
+    assert catalog.render('fr', 'greeting', name='Ada') == 'Bonjour Ada'
+    assert catalog.has_language('FR')
+
+
+@pytest.mark.parametrize('language', ['DE', 'ES', 'IT'])
+def test_broken_or_missing_file_falls_back(locales, language):
+    catalog = Catalog(MESSAGES, keyboards={}, locales_dir=str(locales))
+    assert catalog.render(language, 'greeting', name='Ada') == 'Sannu Ada'
+    assert not catalog.has_language(language)
+    assert catalog._missing == {language}
+
+
+def test_invalid_code_never_reaches_the_filesystem(catalog, locales):
+    # locales_dir is a subdirectory, so '../secret' would resolve to secret.json
+    assert catalog.render('../secret', 'greeting', name='Ada') == 'Sannu Ada'
+    assert not catalog.has_language('../secret')
+    assert catalog._missing == set()
@@ -0,0 +1,94 @@
+import pytest
+
+import migrations
+from storage import Storage
+
+
+def _timestamps(store):
+    return store.connection().execute('SELECT created_at, updated_at FROM deals ORDER BY chat_id').fetchall()
+
+
+def _completed_at(store, version):
+    return store.connection().execute('SELECT completed_at FROM schema_version WHERE version = ?',
+                                      (version,)).fetchone()[0]
+
+
+@pytest.fixture
+def legacy_store(tmp_path):
+    """A database from before created_at/updated_at existed, with 23 deals."""
+    store = Storage(str(tmp_path / 'legacy.db'))
+    migrations.migrate(store, migrations.MIGRATIONS[:2])
+    with store.transaction() as conn:
+        conn.executemany('INSERT INTO deals (chat_id, buyer_id, stage) VALUES (?, ?, ?)',
+                         [(-i, i, 'awaiting_payment') for i in range(1, 24)])
+    yield store
+    store.close()
+
+
+def test_fresh_database_is_fully_migrated(store):
+    report = migrations.migrate(store)
+    assert report.version == migrations.MIGRATIONS[-1].version
+    assert report.steps == []
+
+
+def test_interrupted_backfill_resumes(legacy_store, monkeypatch):
+    calls = []
+    backfill = migrations.MIGRATIONS[2].backfill
+
+    def interrupted(conn, after, batch_size):
+        calls.append(after)
+        if len(calls) == 3:
+            raise KeyboardInterrupt  # e.g. the bot was stopped mid-migration
+        return backfill(conn, after, batch_size)
+
+    steps = migrations.MIGRATIONS[:2] + (migrations.MIGRATIONS[2]._replace(backfill=interrupted),)
+    with pytest.raises(KeyboardInterrupt):
+        migrations.migrate(legacy_store, steps, batch_size=5, pause=0)
+
+    rows = _timestamps(legacy_store)
+    assert sum(created is not None for created, _ in rows) == 10  # two batches committed
+    assert _completed_at(legacy_store, 3) is None
+
+    report = migrations.migrate(legacy_store, batch_size=5, pause=0)
+    assert [(step.version, step.rows_backfilled) for step in report.steps] == [(3, 13)]
+    assert all(created is not None and updated is not None for created, updated in _timestamps(legacy_store))
+    assert _completed_at(legacy_store, 3) is not None
+
+    assert migrations.migrate(legacy_store, batch_size=5, pause=0).steps == []
+
+
+def test_backfill_walks_each_key_once(legacy_store, monkeypatch):
+    calls = []
+    backfill = migrations.MIGRATIONS[2].backfill
+
+    def counted(conn, after, batch_size):
+        calls.append(after)
+        return backfill(conn, after, batch_size)
+
+    steps = migrations.MIGRATIONS[:2] + (migrations.MIGRATIONS[2]._replace(backfill=counted),)
+    migrations.migrate(legacy_store, steps, batch_size=5, pause=0)
+    # 23 rows in batches of 5, then one call that finds nothing past the last key
+    assert calls == [migrations.KEY_START, -19, -14, -9, -4, -1]
+
+
+def test_backfill_runs_after_startup(legacy_store):
+    report = migrations.migrate(legacy_store, backfill=False)
+    assert [(step.version, step.rows_backfilled) for step in report.steps] == [(3, 0)]
+    assert all(created is None for created, _ in _timestamps(legacy_store))
+    assert _completed_at(legacy_store, 3) is None
+
+    migrations.start_backfills(legacy_store, batch_size=5, pause=0).join()
+    assert all(created is not None and updated is not None for created, updated in _timestamps(legacy_store))
+    assert _completed_at(legacy_store, 3) is not None
+    assert migrations.run_backfills(legacy_store) == 0
+
+
+def test_backfill_keeps_existing_timestamps(legacy_store):
+    migrations.migrate(legacy_store, migrations.MIGRATIONS[:3], batch_size=5, pause=0)
+    with legacy_store.transaction() as conn:
+        conn.execute('UPDATE deals SET created_at = 1, updated_at = NULL WHERE chat_id = -1')
+        conn.execute('UPDATE schema_version SET completed_at = NULL WHERE version = 3')
+    migrations.migrate(legacy_store, batch_size=5, pause=0)
+    created, updated = legacy_store.connection().execute(
+        'SELECT created_at, updated_at FROM deals WHERE chat_id = -1').fetchone()
+    assert created == 1 and updated is not None
@@ -0,0 +1,133 @@
+import asyncio
+import json
+import time
+
+from telegram.error import RetryAfter, TimedOut
+from telegram.ext import ApplicationBuilder
+from telegram.request import BaseRequest
+
+import outbound
+
+
+class StubRequest(BaseRequest):
+    """Answers Bot API calls locally and refuses them once shut down, like HTTPXRequest."""
+
+    def __init__(self, sent):
+        self.sent = sent
+        self.closed = False
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        self.closed = True
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None,
+                         write_timeout=None, connect_timeout=None, pool_timeout=None):
+        if self.closed:
+            raise RuntimeError('not initialized')
+        params = request_data.parameters if request_data is not None else {}
+        if url.endswith('/getMe'):
+            result = {'id': 1, 'is_bot': True, 'first_name': 'Escrow', 'username': 'EscrowBot'}
+        else:
+            self.sent.append(params.get('text'))
+            result = {'message_id': len(self.sent), 'date': 0, 'text': params.get('text'),
+                      'chat': {'id': int(params['chat_id']), 'type': 'private'}}
+        return 200, json.dumps({'ok': True, 'result': result}).encode()
+
+
+def test_queue_is_flushed_before_the_bot_shuts_down():
+    sent = []
+
+    async def run():
+        application = (ApplicationBuilder().token('1:test').request(StubRequest(sent))
+                       .get_updates_request(StubRequest([])).updater(None).build())
+        scheduler = outbound.attach(application, private_rate=20.0, private_burst=1)
+        await application.initialize()
+        await application.start()
+        for i in range(5):
+            scheduler.send_message(42, f'message {i}')
+        # The order run_polling and webhook._serve use
+        await application.stop()
+        await application.post_stop(application)
+        await application.shutdown()
+        await application.post_shutdown(application)
+        return scheduler.stats
+
+    stats = asyncio.run(asyncio.wait_for(run(), 10))
+    assert sent == [f'message {i}' for i in range(5)]
+    assert stats['failed'] == 0
+
+
+class FakeBot:
+    """Records (chat_id, text, time) per call; errors[text] is raised the first time(s) text is sent."""
+
+    def __init__(self, errors=None):
+        self.calls = []
+        self.errors = errors or {}
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.calls.append((chat_id, text, time.monotonic()))
+        pending = self.errors.get(text)
+        if pending:
+            raise pending.pop(0)
+        return text
+
+    edit_message_text = send_message
+
+
+def _scheduler(bot, **options):
+    # One call at a time and no flood limits, so the order is fully determined
+    limits = dict(global_rate=1e6, global_burst=1000, private_rate=1e6, private_burst=1000,
+                  group_rate=1e6, group_burst=1000, max_in_flight=1)
+    return outbound.OutboundScheduler(bot, **dict(limits, **options))
+
+
+def test_priority_across_chats_and_order_within_a_chat():
+    bot = FakeBot()
+
+    async def run():
+        scheduler = _scheduler(bot)
+        for text in ('a', 'b', 'c'):
+            scheduler.send_message(-1, text)
+        scheduler.send_message(-2, 'announcement', outbound.PRIORITY_ANNOUNCEMENT)
+        scheduler.send_message(42, 'admin alert', outbound.PRIORITY_ADMIN)
+        await scheduler.stop()
+
+    asyncio.run(asyncio.wait_for(run(), 10))
+    assert [text for _, text, _ in bot.calls] == ['admin alert', 'a', 'b', 'c', 'announcement']
+
+
+def test_retry_after_pauses_every_chat_then_resends():
+    bot = FakeBot({'first': [RetryAfter(1)]})
+
+    async def run():
+        scheduler = _scheduler(bot)
+        first = scheduler.send_message(-1, 'first')
+        scheduler.send_message(-2, 'second')
+        await scheduler.stop()
+        return await first, scheduler.stats
+
+    result, stats = asyncio.run(asyncio.wait_for(run(), 10))
+    assert result == 'first'
+    assert stats['retry_after'] == 1 and stats['retries'] == 1 and stats['failed'] == 0
+    (_, _, refused_at), *rest = bot.calls
+    # The 429 holds the bot-wide bucket, so the other chat waits too
+    assert sorted((chat_id, text) for chat_id, text, _ in rest) == [(-2, 'second'), (-1, 'first')]
+    assert all(sent_at - refused_at >= 0.9 for _, _, sent_at in rest)
+
+
+def test_timed_out_send_is_not_repeated_but_an_edit_is():
+    bot = FakeBot({'send': [TimedOut()], 'edit': [TimedOut()]})
+
+    async def run():
+        scheduler = _scheduler(bot)
+        send = scheduler.send_message(1, 'send')
+        edit = scheduler.edit_message_text(2, 7, 'edit')
+        await scheduler.stop()
+        return await asyncio.gather(send, edit, return_exceptions=True)
+
+    send, edit = asyncio.run(asyncio.wait_for(run(), 10))
+    assert isinstance(send, TimedOut)  # a second send_message could post it twice
+    assert edit == 'edit'
+    assert [text for _, text, _ in bot.calls].count('send') == 1
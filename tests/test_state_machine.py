@@ -0,0 +1,141 @@
+import threading
+
+import pytest
+
+import state_machine
+from storage import Storage
+
+
+def test_concurrent_fire_only_one_wins(store, make_deal):
+    make_deal(-100, state_machine.AWAITING_PAYMENT)
+    taps = 8
+    barrier = threading.Barrier(taps)
+    results = []
+
+    def tap():
+        # Each thread gets its own connection, like separate handlers or workers
+        barrier.wait()
+        results.append(state_machine.fire(store, -100, 'buyer_paid'))
+
+    threads = [threading.Thread(target=tap) for _ in range(taps)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sum(result.ok for result in results) == 1
+    assert store.load_deal(-100)['stage'] == state_machine.PAYMENT_SENT
+
+
+def test_concurrent_fire_across_stores_only_one_wins(tmp_path, make_deal):
+    # Separate Storage objects stand in for webhook worker processes
+    make_deal(-100, state_machine.AWAITING_PAYMENT)
+    stores = [Storage(str(tmp_path / 'escrow.db')) for _ in range(4)]
+    barrier = threading.Barrier(len(stores))
+    results = []
+
+    def tap(other):
+        barrier.wait()
+        results.append(state_machine.fire(other, -100, 'buyer_not_paid'))
+
+    threads = [threading.Thread(target=tap, args=(other,)) for other in stores]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for other in stores:
+        other.close()
+
+    assert sum(result.ok for result in results) == 1
+
+
+def test_fire_moves_stage_and_fills_fields(store, make_deal):
+    make_deal(-100, state_machine.AWAITING_SELLER, seller_id=None, seller_username=None)
+    result = state_machine.fire(store, -100, 'seller_joined', seller_id=7, seller_username='new_seller')
+    assert result.ok and not result.conflict
+    assert result.deal['stage'] == state_machine.AWAITING_PAYMENT
+    assert result.deal['seller_username'] == 'new_seller'
+    assert store.get_deal(-100) == result.deal
+
+
+def test_fire_from_wrong_stage_is_a_conflict(store, make_deal):
+    make_deal(-100, state_machine.DELIVERED)
+    result = state_machine.fire(store, -100, 'buyer_paid')
+    assert result.conflict
+    assert result.deal is None
+    assert store.load_deal(-100)['stage'] == state_machine.DELIVERED
+
+
+def test_fire_on_missing_deal_is_a_conflict(store):
+    result = state_machine.fire(store, -404, 'buyer_paid')
+    assert result.conflict and result.deal is None
+
+
+def test_second_tap_is_a_conflict(store, make_deal):
+    make_deal(-100, state_machine.PAYMENT_SENT)
+    assert state_machine.fire(store, -100, 'admin_confirm').ok
+    assert state_machine.fire(store, -100, 'admin_confirm').conflict
+
+
+def test_cancel_removes_the_deal(store, make_deal):
+    make_deal(-100, state_machine.AWAITING_PAYMENT)
+    result = state_machine.fire(store, -100, 'buyer_not_paid')
+    assert result.ok and result.deal['chat_id'] == -100
+    assert store.get_deal(-100) is None
+    assert state_machine.fire(store, -100, 'buyer_not_paid').conflict
+
+
+def test_unknown_event_raises(store):
+    with pytest.raises(state_machine.StateMachineError):
+        state_machine.fire(store, -100, 'no_such_event')
+
+
+def test_update_of_unknown_column_raises(store, make_deal):
+    make_deal(-100, state_machine.AWAITING_SELLER)
+    with pytest.raises(ValueError):
+        state_machine.fire(store, -100, 'seller_joined', stage='complete')
+
+
+def _new_deal(chat_id, buyer_username='new_buyer'):
+    return {'chat_id': chat_id, 'buyer_id': 9, 'buyer_username': buyer_username, 'buyer_address': 'addr'}
+
+
+def test_open_deal_on_free_chat(store):
+    result = state_machine.open_deal(store, _new_deal(-100))
+    assert result.ok
+    assert result.deal['stage'] == state_machine.AWAITING_SELLER
+    assert state_machine.open_deal(store, _new_deal(-100, 'other')).conflict
+
+
+@pytest.mark.parametrize('stage', [stage for stage in state_machine.STAGES if stage != state_machine.COMPLETE])
+def test_open_deal_keeps_unfinished_deals(store, make_deal, stage):
+    before = make_deal(-100, stage)
+    result = state_machine.open_deal(store, _new_deal(-100))
+    assert result.conflict and result.deal is None
+    assert store.load_deal(-100) == before
+
+
+def test_open_deal_replaces_complete_deal(store, make_deal):
+    make_deal(-100, state_machine.COMPLETE)
+    result = state_machine.open_deal(store, _new_deal(-100))
+    assert result.ok
+    deal = store.load_deal(-100)
+    assert deal['stage'] == state_machine.AWAITING_SELLER
+    assert deal['buyer_username'] == 'new_buyer'
+    assert deal['seller_id'] is None
+
+
+def test_fire_many_only_moves_deals_in_source_stages(store, make_deal):
+    make_deal(-1, state_machine.RECEIVED)
+    make_deal(-2, state_machine.DISPUTE)
+    make_deal(-3, state_machine.PAYMENT_SENT)
+    moved = state_machine.fire_many(store, [-1, -2, -3, -4], 'admin_release', (state_machine.RECEIVED,))
+    assert [deal['chat_id'] for deal in moved] == [-1]
+    assert store.get_deal(-1)['stage'] == state_machine.RELEASED
+    assert store.get_deal(-2)['stage'] == state_machine.DISPUTE
+    assert store.get_deal(-3)['stage'] == state_machine.PAYMENT_SENT
+
+
+def test_fire_many_rejects_sources_outside_the_transition(store):
+    with pytest.raises(state_machine.StateMachineError):
+        state_machine.fire_many(store, None, 'admin_release', (state_machine.PAYMENT_SENT,))
@@ -0,0 +1,55 @@
+import pytest
+
+import webhook
+
+GROUP = -1001234567890
+ADMIN = 42
+
+
+def _chat(chat_id):
+    return {'id': chat_id, 'type': 'private' if chat_id > 0 else 'supergroup'}
+
+
+def _tap(chat_id, data, user_id=ADMIN):
+    return {'update_id': 1, 'callback_query': {
+        'id': '1', 'from': {'id': user_id}, 'chat_instance': '1', 'data': data,
+        'message': {'message_id': 1, 'date': 0, 'chat': _chat(chat_id)},
+    }}
+
+
+@pytest.mark.parametrize('field', ['message', 'edited_message', 'my_chat_member', 'channel_post'])
+def test_chat_updates_shard_by_chat(field):
+    assert webhook.shard_key({'update_id': 1, field: {'chat': _chat(GROUP)}}) == GROUP
+
+
+def test_admin_buttons_shard_by_the_deal_they_act_on():
+    # Pressed in the admin's DM, but must stay in order with the group's updates
+    assert webhook.shard_key(_tap(ADMIN, f'admin_confirm:{GROUP}')) == GROUP
+    assert webhook.shard_key(_tap(ADMIN, 'admin_release:-5')) == -5
+
+
+def test_other_buttons_shard_by_their_message_chat():
+    assert webhook.shard_key(_tap(GROUP, 'buyer_paid')) == GROUP
+    assert webhook.shard_key(_tap(GROUP, 'lang:EN')) == GROUP
+
+
+def test_button_without_message_shards_by_user():
+    update = _tap(GROUP, 'buyer_paid', user_id=7)
+    del update['callback_query']['message']
+    assert webhook.shard_key(update) == 7
+
+
+def test_user_only_updates_shard_by_user():
+    assert webhook.shard_key({'update_id': 1, 'inline_query': {'from': {'id': 7}}}) == 7
+    assert webhook.shard_key({'update_id': 1, 'poll_answer': {'user': {'id': 8}}}) == 8
+
+
+def test_unknown_updates_go_to_worker_zero():
+    key = webhook.shard_key({'update_id': 1, 'something_new': {}})
+    assert key == 0
+    assert webhook.worker_for(key, 4) == 0
+
+
+def test_a_chat_always_maps_to_one_worker():
+    assert {webhook.worker_for(GROUP, 3) for _ in range(5)} == {GROUP % 3}
+    assert all(0 <= webhook.worker_for(chat_id, 3) < 3 for chat_id in (GROUP, -1, 0, 1, ADMIN))
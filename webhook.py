@@ -0,0 +1,281 @@
+import asyncio
+import hmac
+import json
+import logging
+import multiprocessing
+import secrets
+import signal
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from telegram import Bot, Update
+
+logger = logging.getLogger(__name__)
+
+# --- Webhook Defaults ---
+WORKERS = 2
+LISTEN = '127.0.0.1'  # Telegram only calls https URLs: put a TLS proxy or tunnel in front
+PORT = 8443
+URL_PATH = '/telegram'
+WATCH_INTERVAL = 1.0  # seconds between checks for dead workers
+# Telegram opens up to 40 connections by default and the front answers each on
+# its own thread, so two updates for one chat could be dispatched out of order.
+# With one connection Telegram sends the next update only after the last 200.
+MAX_CONNECTIONS = 1
+LOG_FORMAT = '%(asctime)s %(processName)s %(name)s %(levelname)s %(message)s'
+
+_STOP = None
+
+# Update fields that carry a chat, and ones that only carry a user
+_CHAT_FIELDS = ('message', 'edited_message', 'my_chat_member', 'chat_member', 'chat_join_request',
+                'channel_post', 'edited_channel_post')
+_USER_FIELDS = ('inline_query', 'chosen_inline_result', 'shipping_query', 'pre_checkout_query', 'poll_answer')
+
+
+def shard_key(data):
+    """Returns the chat_id an update (as parsed JSON) belongs to, or 0 if it has none.
+
+    Admin buttons (admin_confirm:<chat_id> and friends) are pressed in the
+    admin's DM but act on a group's deal, so they count as that group's
+    updates and stay in order with the rest of the deal.
+    """
+    query = data.get('callback_query')
+    if query is not None:
+        _, sep, suffix = (query.get('data') or '').rpartition(':')
+        if sep and suffix.lstrip('-').isdigit():
+            return int(suffix)
+        message = query.get('message')
+        return message['chat']['id'] if message else query['from']['id']
+    for field in _CHAT_FIELDS:
+        if field in data:
+            return data[field]['chat']['id']
+    for field in _USER_FIELDS:
+        if field in data:
+            return (data[field].get('from') or data[field]['user'])['id']
+    return 0
+
+
+def worker_for(chat_id, workers):
+    return chat_id % workers
+
+
+# --- Workers ---
+class Dispatcher:
+    """Routes updates to worker processes by chat_id.
+
+    Each worker builds its own Application with factory(worker, workers) and
+    feeds its share of updates through it one at a time, so a deal's updates
+    are handled in arrival order while other groups run in parallel on
+    other cores. Workers are spawned rather than forked so none of them
+    inherits this process's SQLite connections or threads; the factory must
+    be a module-level function.
+    """
+
+    def __init__(self, factory, workers=WORKERS):
+        self.factory = factory
+        self.workers = workers
+        self._context = multiprocessing.get_context('spawn')
+        self._queues = [self._context.Queue() for _ in range(workers)]
+        self._ready = [self._context.Event() for _ in range(workers)]
+        self._processes = [None] * workers
+        self._lock = threading.Lock()
+        self._stopping = False
+        self.dispatched = [0] * workers
+        # Spawned workers start with logging unconfigured; they log at the front's level
+        self.log_level = logging.getLogger().getEffectiveLevel()
+
+    def start(self, timeout=60):
+        """Starts every worker and waits until they can take updates."""
+        for worker in range(self.workers):
+            self._spawn(worker)
+        deadline = time.monotonic() + timeout
+        for worker, ready in enumerate(self._ready):
+            while not ready.wait(0.1):
+                if not self._processes[worker].is_alive():
+                    raise RuntimeError(f'webhook worker {worker} exited while starting')
+                if time.monotonic() > deadline:
+                    raise RuntimeError(f'webhook worker {worker} did not start within {timeout}s')
+
+    def _spawn(self, worker):
+        self._ready[worker].clear()
+        process = self._context.Process(
+            target=_run_worker,
+            args=(self.factory, worker, self.workers, self._queues[worker], self._ready[worker], self.log_level),
+            name=f'escrow-worker-{worker}',
+            daemon=True,
+        )
+        process.start()
+        self._processes[worker] = process
+
+    def dispatch(self, data):
+        """Queues one update for the worker that owns its chat; returns that worker."""
+        worker = worker_for(shard_key(data), self.workers)
+        with self._lock:
+            self._queues[worker].put(data)
+            self.dispatched[worker] += 1
+        return worker
+
+    def watch(self):
+        """Restarts workers that died.
+
+        A killed worker may still hold its queue's read lock, so the new one
+        gets a fresh queue: updates the dead worker had not handled yet are
+        lost with it (Telegram already has its 200 for them).
+        """
+        for worker, process in enumerate(self._processes):
+            if not self._stopping and process is not None and not process.is_alive():
+                logger.error("Webhook worker %d exited with code %s, restarting it", worker, process.exitcode)
+                with self._lock:
+                    self._queues[worker] = self._context.Queue()
+                self._spawn(worker)
+
+    def stop(self, timeout=30):
+        """Lets every worker finish the updates already queued, then shuts them down."""
+        self._stopping = True
+        for updates in self._queues:
+            updates.put(_STOP)
+        for worker, process in enumerate(self._processes):
+            if process is None:
+                continue
+            process.join(timeout)
+            if process.is_alive():
+                logger.warning("Webhook worker %d did not stop in time, terminating it", worker)
+                process.terminate()
+                process.join()
+
+
+def _run_worker(factory, worker, workers, updates, ready, log_level=logging.INFO):
+    # Ctrl+C reaches the whole process group; the front stops workers in order instead
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # The main module's `if __name__ == "__main__"` block does not run in a spawned process
+    logging.basicConfig(format=LOG_FORMAT, level=log_level)
+    asyncio.run(_serve(factory, worker, workers, updates, ready))
+
+
+async def _serve(factory, worker, workers, updates, ready):
+    """Runs one worker's Application the way run_polling would, minus the polling."""
+    application = factory(worker, workers)
+    loop = asyncio.get_running_loop()
+    await application.initialize()
+    if application.post_init is not None:
+        await application.post_init(application)
+    await application.start()
+    ready.set()
+    try:
+        while True:
+            data = await loop.run_in_executor(None, updates.get)
+            if data is _STOP:
+                break
+            try:
+                update = Update.de_json(data, application.bot)
+            except Exception:
+                logger.exception("Worker %d dropped an update it could not parse", worker)
+                continue
+            # The application handles its queue one update at a time (concurrent_updates off)
+            await application.update_queue.put(update)
+    finally:
+        await application.stop()
+        if application.post_stop is not None:
+            await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown is not None:
+            await application.post_shutdown(application)
+
+
+# --- HTTP Front ---
+class _WebhookHandler(BaseHTTPRequestHandler):
+    dispatcher = None
+    url_path = URL_PATH
+    secret_token = b''
+
+    def do_POST(self):
+        if self.path.split('?')[0] != self.url_path:
+            self.send_error(404)
+            return
+        # Without this anyone who finds the URL could post admin button presses
+        given = self.headers.get('X-Telegram-Bot-Api-Secret-Token', '').encode()
+        if not self.secret_token or not hmac.compare_digest(given, self.secret_token):
+            self.send_error(403)
+            return
+        try:
+            data = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+        except ValueError:
+            self.send_error(400)
+            return
+        # Answer at once: the worker handles the update after Telegram has its 200
+        self.dispatcher.dispatch(data)
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass  # one line per update would flood the bot's log
+
+
+def start_http_server(dispatcher, secret_token, port=PORT, host=LISTEN, url_path=URL_PATH):
+    """Receives webhook POSTs on url_path from a daemon thread and hands them to dispatcher.
+
+    Only POSTs carrying secret_token in X-Telegram-Bot-Api-Secret-Token are accepted.
+    """
+    if not secret_token:
+        raise ValueError('the webhook needs a secret_token')
+    handler = type('WebhookHandler', (_WebhookHandler,),
+                   {'dispatcher': dispatcher, 'url_path': url_path, 'secret_token': secret_token.encode()})
+    server = ThreadingHTTPServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, name='webhook-http', daemon=True).start()
+    logger.info("Receiving updates on http://%s:%s%s", host, port, url_path)
+    return server
+
+
+async def set_webhook(token, url, secret_token=None, allowed_updates=None, drop_pending_updates=False,
+                      max_connections=MAX_CONNECTIONS):
+    async with Bot(token) as bot:
+        await bot.set_webhook(url, secret_token=secret_token, allowed_updates=allowed_updates,
+                              drop_pending_updates=drop_pending_updates, max_connections=max_connections)
+
+
+def run(factory, token, url, workers=WORKERS, listen=LISTEN, port=PORT, url_path=URL_PATH,
+        secret_token=None, allowed_updates=None, drop_pending_updates=False, prepare=None,
+        max_connections=MAX_CONNECTIONS):
+    """Serves the bot by webhook with `workers` processes until SIGINT or SIGTERM.
+
+    url is the public https base Telegram should call; url_path is appended.
+    Telegram is told to send secret_token with every update and anything
+    without it is refused; when none is given a random one is made per run.
+    prepare runs once here before any worker starts, e.g. init_db() so the
+    migrations are not raced by several processes. Keep max_connections at 1
+    unless updates carry no per-chat ordering: with more, Telegram delivers
+    concurrently and a chat's updates can reach its worker out of order.
+
+    factory(worker, workers) builds a fully wired Application in each worker.
+    Everything in it is per process, so with several workers it should:
+    - use a Storage with caching off, as main.py does when WEBHOOK_URL is set.
+      The deals and user_languages tables are then the only copy of shared
+      state. Each chat's updates stay on one worker, but bulk admin commands
+      and language changes cross shards.
+    - give outbound.attach() global_rate=outbound.GLOBAL_RATE / workers so that
+      together the workers stay under Telegram's bot-wide limit.
+    - attach the admin queue with post_digest=(worker == 0) and poll=True, so one
+      worker posts the digest and picks up deals changed by the others.
+    - pass a distinct metrics port per worker, e.g. METRICS_PORT + worker.
+    """
+    secret_token = secret_token or secrets.token_urlsafe(32)
+    if prepare is not None:
+        prepare()
+    dispatcher = Dispatcher(factory, workers)
+    dispatcher.start()
+    server = start_http_server(dispatcher, secret_token, port, listen, url_path)
+    asyncio.run(set_webhook(token, url.rstrip('/') + url_path, secret_token, allowed_updates,
+                            drop_pending_updates, max_connections))
+
+    stopping = threading.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_: stopping.set())
+    try:
+        while not stopping.wait(WATCH_INTERVAL):
+            dispatcher.watch()
+    finally:
+        # The webhook stays set, so Telegram holds new updates until the bot is back
+        server.shutdown()
+        dispatcher.stop()